@@ -1,87 +1,135 @@
 import chainlit as cl
 from realtime_client import RTWSClient
+from envconfig import DefaultConfig
+from tools import warm_up
+from loop_monitor import monitor
+import capacity
+from capacity import session_admission
+from grievance_queue import get_grievance_queue
+from chainlit.server import app as server_app
+from fastapi import Header, HTTPException
 from uuid import uuid4
+from chainlit.logger import logger
 import traceback
+import asyncio
 
 
-async def init_rtclient():
-    openai_realtime = RTWSClient(system_prompt=system_prompt)
-    cl.user_session.set("track_id", str(uuid4()))
-    cl.user_session.set("transcript", ["1", "-"])
-    cl.user_session.set("user_input_transcript", ["1", ""])
-
-    async def handle_conversation_updated(event):
-        """Used to play the response audio chunks as they are received from the server."""
-        _audio = event.get("audio")
-        if _audio:
-            await cl.context.emitter.send_audio_chunk(
-                cl.OutputAudioChunk(
-                    mimeType="pcm16", data=_audio, track=cl.user_session.get("track_id")
-                )
+class TranscriptState:
+    """The audio track and the transcripts in progress for a chat. One of these is kept per chat, so it holds only what is needed."""
+
+    __slots__ = ("track_id", "assistant_item_id", "assistant_text", "user_message_id")
+
+    def __init__(self):
+        self.track_id = str(uuid4())
+        self.assistant_item_id = "1"
+        self.assistant_text = "-"
+        self.user_message_id = "1"
+
+
+# The handlers of the realtime client events are shared by all the chats. They get the state of the chat
+# from the chainlit user session, which is the one of the chat the client belongs to
+
+
+async def handle_conversation_updated(event):
+    """Used to play the response audio chunks as they are received from the server."""
+    _audio = event.get("audio")
+    if _audio:
+        await cl.context.emitter.send_audio_chunk(
+            cl.OutputAudioChunk(
+                mimeType="pcm16", data=_audio, track=cl.user_session.get("transcript_state").track_id
             )
+        )
 
-    async def handle_conversation_interrupt(event):
-        """This applies when the user interrupts during an audio playback.
-        This stops the audio playback to listen to what the user has to say"""
-        cl.user_session.set("track_id", str(uuid4()))
-        await cl.context.emitter.send_audio_interrupt()
-
-    async def handle_conversation_thread_updated(event):
-        """Used to populate the chat context with transcription once an audio transcript of the response is done."""
-        item_id = event.get("item_id")
-        delta = event.get("transcript")
-        if delta:
-            transcript_ref = cl.user_session.get("transcript")
-            # print(f"item_id in delta is {item_id}, and the one in the session is {transcript_ref[0]}")
-            
-            # identify if there is a new message or an update to an existing message (i.e. delta to an existing transcript)
-            if transcript_ref[0] == item_id:
-                _transcript = transcript_ref[1] + delta
-                transcript_ref = [item_id, _transcript]
-                cl.user_session.set("transcript", transcript_ref)
-                # appending the delta transcript from audio to the previous transcript
-                # using the message id as the key to update the message in the chat window
-                await cl.Message(
-                    content=_transcript,
-                    author="assistant",
-                    type="assistant_message",
-                    id=item_id,
-                ).update()
-            else:
-                transcript_ref = [item_id, delta]
-                
-                # create a placeholder message for the user input first
-                # we can set the actual message later when the server provides it
-                user_transcript_msg_id = str(uuid4())
-                cl.user_session.set("user_input_transcript", [user_transcript_msg_id,"" ])
-                await cl.Message(
-                    content="",
-                    author="user",
-                    type="user_message",
-                    id=user_transcript_msg_id,
-                ).send()
-                
-                # now populate the assistant response transcript in the chat interface
-                cl.user_session.set("transcript", transcript_ref)
-                await cl.Message(
-                    content=delta,
-                    author="assistant",
-                    type="assistant_message",
-                    id=item_id,
-                ).send()
-
-    async def handle_user_input_transcript_done(event):
-        """Used to populate the chat context with transcription once an audio transcript of user input is completed.
-        Note that the user input transcript happens aynchronous to the response transcript, and the sequence of the two
-        in the chat window would not be correct.
-        """
-        transcript = event.get("transcript")
-        msg_id = cl.user_session.get("user_input_transcript")[0]
-        # await cl.Message(content=transcript, author="user", type="user_message").send()
-        
-        # A placeholder message was created for the user input transcript earlier. updating the message with the actual transcript
-        await cl.Message(content=transcript, author="user", type="user_message",id=msg_id).update()
-        cl.user_session.set("user_input_transcript",[str(uuid4()),""])
+
+async def handle_conversation_interrupt(event):
+    """This applies when the user interrupts during an audio playback.
+    This stops the audio playback to listen to what the user has to say"""
+    cl.user_session.get("transcript_state").track_id = str(uuid4())
+    await cl.context.emitter.send_audio_interrupt()
+
+
+async def handle_conversation_thread_updated(event):
+    """Used to populate the chat context with transcription once an audio transcript of the response is done."""
+    item_id = event.get("item_id")
+    delta = event.get("transcript")
+    if delta:
+        state: TranscriptState = cl.user_session.get("transcript_state")
+
+        # identify if there is a new message or an update to an existing message (i.e. delta to an existing transcript)
+        if state.assistant_item_id == item_id:
+            state.assistant_text += delta
+            # appending the delta transcript from audio to the previous transcript
+            # using the message id as the key to update the message in the chat window
+            await cl.Message(
+                content=state.assistant_text,
+                author="assistant",
+                type="assistant_message",
+                id=item_id,
+            ).update()
+        else:
+            # create a placeholder message for the user input first
+            # we can set the actual message later when the server provides it
+            state.user_message_id = str(uuid4())
+            await cl.Message(
+                content="",
+                author="user",
+                type="user_message",
+                id=state.user_message_id,
+            ).send()
+
+            # now populate the assistant response transcript in the chat interface
+            state.assistant_item_id = item_id
+            state.assistant_text = delta
+            await cl.Message(
+                content=delta,
+                author="assistant",
+                type="assistant_message",
+                id=item_id,
+            ).send()
+
+
+async def handle_user_input_transcript_done(event):
+    """Used to populate the chat context with transcription once an audio transcript of user input is completed.
+    Note that the user input transcript happens aynchronous to the response transcript, and the sequence of the two
+    in the chat window would not be correct.
+    """
+    transcript = event.get("transcript")
+    state: TranscriptState = cl.user_session.get("transcript_state")
+
+    # A placeholder message was created for the user input transcript earlier. updating the message with the actual transcript
+    await cl.Message(content=transcript, author="user", type="user_message", id=state.user_message_id).update()
+    state.user_message_id = str(uuid4())
+
+
+async def handle_session_idle(event):
+    """The realtime connection was closed after a period of inactivity. Its session slot is freed,
+    and it is opened again when the user next speaks or sends a message."""
+    release_session()
+    cl.user_session.set("idle_disconnected", True)
+    await cl.Message(
+        content="The voice session was paused after a period of inactivity. Just start talking, or send a message, to resume."
+    ).send()
+
+
+_warm_up_task = None
+
+
+def start_warm_up():
+    """Loads the client libraries used by the tools off the event loop, once per process, ahead of the first tool call."""
+    global _warm_up_task
+    if _warm_up_task is None:
+        _warm_up_task = asyncio.create_task(asyncio.to_thread(warm_up))
+        _warm_up_task.add_done_callback(log_warm_up_failure)
+
+
+def log_warm_up_failure(task):
+    if not task.cancelled() and task.exception():
+        logger.error(f"Error warming up the tools: {task.exception()}")
+
+
+async def init_rtclient():
+    openai_realtime = RTWSClient(system_prompt=system_prompt)
+    cl.user_session.set("transcript_state", TranscriptState())
 
     openai_realtime.on("conversation.updated", handle_conversation_updated)
     openai_realtime.on("conversation.interrupted", handle_conversation_interrupt)
@@ -89,6 +137,7 @@ async def init_rtclient():
     openai_realtime.on(
         "conversation.input.text.done", handle_user_input_transcript_done
     )
+    openai_realtime.on("session.idle", handle_session_idle)
     cl.user_session.set("openai_realtime", openai_realtime)
 
 
@@ -101,12 +150,50 @@ Before responding, review what you are going to say out, and ensure it honours t
 """
 
 
+if DefaultConfig.admin_token:
+    # admin endpoints. These use POST, since chainlit serves its UI on all GET paths
+
+    def check_admin_token(token):
+        if token != DefaultConfig.admin_token:
+            raise HTTPException(status_code=403, detail="invalid admin token")
+
+    @server_app.post("/admin/loop-monitor/stats")
+    async def loop_monitor_stats(x_admin_token: str = Header(None)):
+        check_admin_token(x_admin_token)
+        return monitor.snapshot()
+
+    @server_app.post("/admin/loop-monitor/profile")
+    async def loop_monitor_profile(seconds: float = 30, x_admin_token: str = Header(None)):
+        check_admin_token(x_admin_token)
+        # the profiler samples every thread while it runs, so keep it short
+        if not 1 <= seconds <= 300:
+            raise HTTPException(status_code=400, detail="seconds must be between 1 and 300")
+        if not monitor.enabled:
+            monitor.start(DefaultConfig.loop_monitor_slow_callback_ms, profile_dir=DefaultConfig.loop_monitor_profile_dir)
+        return {"started": monitor.start_profile(seconds), "profile_dir": monitor.profile_dir}
+
+    @server_app.post("/admin/capacity/stats")
+    async def capacity_stats(x_admin_token: str = Header(None)):
+        check_admin_token(x_admin_token)
+        return capacity.snapshot() | {"grievances": get_grievance_queue().stats()}
+
+
 @cl.on_chat_start
 async def start():
     await cl.Message(
         content="Hi, Welcome! You are now connected to Realtime' AI Assistant representing Contoso Education Society. Press `P` to talk!"
     ).send()
     await init_rtclient()
+    if session_admission.is_full():
+        await cl.Message(
+            content="The assistant is very busy right now. You may have to wait for a moment when you start talking."
+        ).send()
+    if DefaultConfig.loop_monitor_enabled:
+        monitor.start(DefaultConfig.loop_monitor_slow_callback_ms, profile_dir=DefaultConfig.loop_monitor_profile_dir)
+    # open the grievance queue, so that grievances left pending by an earlier run get submitted
+    await asyncio.to_thread(get_grievance_queue)
+    if DefaultConfig.tools_warm_up:
+        start_warm_up()
     openai_realtime: RTWSClient = cl.user_session.get("openai_realtime")
     print("status of connection to realtime api", openai_realtime.is_connected())
 
@@ -115,6 +202,11 @@ async def start():
 @cl.on_message
 async def on_message(message: cl.Message):
     openai_realtime: RTWSClient = cl.user_session.get("openai_realtime")
+    if openai_realtime and not openai_realtime.is_connected() and cl.user_session.get("idle_disconnected"):
+        # the user types again after the connection was closed for inactivity
+        cl.user_session.set("idle_disconnected", False)
+        if not await start_realtime_session():
+            return
     if openai_realtime and openai_realtime.is_connected():
         await openai_realtime.send_user_message_content(
             [{"type": "input_text", "text": message.content}]
@@ -125,25 +217,80 @@ async def on_message(message: cl.Message):
         ).send()
 
 
-@cl.on_audio_start
-async def on_audio_start():
+async def admit_session():
+    """Gets a realtime session slot for the user, waiting in the queue if the worker is at its session cap."""
+    if cl.user_session.get("admitted"):
+        return True
+
+    async def notify_queued(position):
+        await cl.Message(
+            content=f"All our assistants are busy right now. You are number {position} in the queue, please hold on."
+        ).send()
+
+    # the wait is kept in the session, so that it is cancelled if the user leaves or stops the audio while queued
+    admission_wait = asyncio.create_task(session_admission.acquire(notify_queued))
+    cl.user_session.set("admission_wait", admission_wait)
+    try:
+        admitted = await admission_wait
+    except asyncio.CancelledError:
+        admitted = False
+    finally:
+        cl.user_session.set("admission_wait", None)
+    if not admitted:
+        return False
+    cl.user_session.set("admitted", True)
+    if cl.user_session.get("chat_ended"):
+        # the chat ended just as the slot was handed over
+        release_session()
+        return False
+    return True
+
+
+def release_session():
+    if cl.user_session.get("admitted"):
+        cl.user_session.set("admitted", False)
+        session_admission.release()
+
+
+async def start_realtime_session():
+    """Admits the session, and connects the realtime client. Returns whether the session is connected."""
+    if not await admit_session():
+        await cl.ErrorMessage(
+            content="The assistant is busy helping other students right now. Please try again in a few minutes."
+        ).send()
+        return False
     try:
         openai_realtime: RTWSClient = cl.user_session.get("openai_realtime")
         await openai_realtime.connect()
+        if not cl.user_session.get("admitted") or cl.user_session.get("chat_ended"):
+            # the audio was stopped, or the chat ended, during the handshake, and the slot was given back
+            await openai_realtime.disconnect()
+            return False
         print("audio started")
         return True
     except Exception as e:
+        release_session()
         await cl.ErrorMessage(
             content=f"Failed to connect to OpenAI realtime: {e}"
         ).send()
         return False
 
 
+@cl.on_audio_start
+async def on_audio_start():
+    cl.user_session.set("idle_disconnected", False)
+    return await start_realtime_session()
+
+
 @cl.on_audio_chunk
 async def on_audio_chunk(chunk: cl.InputAudioChunk):
     openai_realtime: RTWSClient = cl.user_session.get("openai_realtime")
     try:
         if openai_realtime:
+            if not openai_realtime.is_connected() and cl.user_session.get("idle_disconnected"):
+                # the user speaks again after the connection was closed for inactivity
+                cl.user_session.set("idle_disconnected", False)
+                await start_realtime_session()
             if openai_realtime and openai_realtime.is_connected():
                 await openai_realtime.append_input_audio(chunk.data)
             # else:
@@ -157,10 +304,20 @@ async def on_audio_chunk(chunk: cl.InputAudioChunk):
 
 
 @cl.on_audio_end
-@cl.on_chat_end
 @cl.on_stop
 async def on_end():
     openai_realtime: RTWSClient = cl.user_session.get("openai_realtime")
+    admission_wait = cl.user_session.get("admission_wait")
+    if admission_wait and not admission_wait.done():
+        admission_wait.cancel()
+    cl.user_session.set("idle_disconnected", False)
     if openai_realtime and openai_realtime.is_connected():
         print("RealtimeClient session ended")
         await openai_realtime.disconnect()
+    release_session()
+
+
+@cl.on_chat_end
+async def on_chat_end():
+    cl.user_session.set("chat_ended", True)
+    await on_end()
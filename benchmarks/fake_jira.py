@@ -0,0 +1,135 @@
+"""
+A local fake of the Jira endpoints used by the assistant, to run the grievance queue without a Jira Cloud site.
+
+It keeps the issues in memory and implements:
+- POST /rest/api/2/issue/bulk: creates issues, failing a share of them when --fail-rate is set
+- GET /rest/api/2/search: finds issues with JQL of the forms "... id = N", "... key = X" and "labels in (...)"
+- GET /rest/api/2/myself
+
+Point attlassian_url at it in the .env file:
+
+    python benchmarks/fake_jira.py --port 8089 --latency-ms 500 --fail-rate 0.2
+    attlassian_url = 'http://127.0.0.1:8089/'
+"""
+import argparse
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+
+class FakeJira:
+    def __init__(self, latency_ms=0, fail_rate=0.0, seed=0):
+        self.latency_ms = latency_ms
+        self.fail_rate = fail_rate
+        self.rng = random.Random(seed)
+        self.issues = {}
+        self.next_id = 10000
+        self.bulk_calls = 0
+        self.lock = threading.Lock()
+
+    def create_issues(self, issue_updates):
+        created, errors = [], []
+        with self.lock:
+            self.bulk_calls += 1
+            for index, update in enumerate(issue_updates):
+                if self.rng.random() < self.fail_rate:
+                    errors.append(
+                        {"status": 500, "elementErrors": {"errorMessages": ["fake failure"]}, "failedElementNumber": index}
+                    )
+                    continue
+                fields = update["fields"]
+                issue_id = str(self.next_id)
+                self.next_id += 1
+                issue = {
+                    "id": issue_id,
+                    "key": f"{fields['project']['key']}-{issue_id}",
+                    "fields": {
+                        "summary": fields.get("summary"),
+                        "description": fields.get("description"),
+                        "labels": fields.get("labels", []),
+                        "priority": {"name": "Medium"},
+                        "status": {"statusCategory": {"key": "new"}},
+                        "duedate": None,
+                    },
+                }
+                self.issues[issue_id] = issue
+                created.append({"id": issue["id"], "key": issue["key"], "self": f"/rest/api/2/issue/{issue_id}"})
+        return {"issues": created, "errors": errors}
+
+    def search(self, jql):
+        with self.lock:
+            issues = list(self.issues.values())
+        match = re.search(r"\bid\s*=\s*(\d+)", jql)
+        if match:
+            return [issue for issue in issues if issue["id"] == match.group(1)]
+        match = re.search(r"\bkey\s*=\s*\"?([\w-]+)", jql)
+        if match:
+            return [issue for issue in issues if issue["key"] == match.group(1)]
+        match = re.search(r"labels\s+in\s*\((.*)\)", jql)
+        if match:
+            labels = set(re.findall(r'"([^"]+)"', match.group(1)))
+            return [issue for issue in issues if labels & set(issue["fields"]["labels"])]
+        return issues
+
+
+def make_handler(jira):
+    class Handler(BaseHTTPRequestHandler):
+        def _reply(self, status, body):
+            payload = json.dumps(body).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def do_GET(self):
+            time.sleep(jira.latency_ms / 1000)
+            url = urlparse(self.path)
+            if url.path.endswith("/rest/api/2/myself"):
+                self._reply(200, {"name": "fake", "displayName": "Fake Jira"})
+            elif url.path.endswith("/rest/api/2/search"):
+                issues = jira.search(parse_qs(url.query).get("jql", [""])[0])
+                self._reply(200, {"startAt": 0, "maxResults": len(issues), "total": len(issues), "issues": issues})
+            else:
+                self._reply(404, {"errorMessages": [f"no fake for {url.path}"]})
+
+        def do_POST(self):
+            time.sleep(jira.latency_ms / 1000)
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            if urlparse(self.path).path.endswith("/rest/api/2/issue/bulk"):
+                response = jira.create_issues(body.get("issueUpdates", []))
+                self._reply(201 if response["issues"] else 400, response)
+            else:
+                self._reply(404, {"errorMessages": [f"no fake for {self.path}"]})
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def serve(port, jira):
+    """Starts the fake on a background thread, and returns the server. Call shutdown() on it to stop it."""
+    server = ThreadingHTTPServer(("127.0.0.1", port), make_handler(jira))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--latency-ms", type=int, default=0, help="delay added to every request")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="share of the issues the bulk create fails")
+    args = parser.parse_args()
+    jira = FakeJira(args.latency_ms, args.fail_rate)
+    server = ThreadingHTTPServer(("127.0.0.1", args.port), make_handler(jira))
+    print(f"fake Jira listening on http://127.0.0.1:{args.port}/")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,282 @@
+"""
+Load generator to find how many concurrent voice sessions a single worker can sustain.
+
+It starts a local stand-in for the Realtime API (benchmarks/realtime_stub_server.py) in a separate process,
+replaces the tools with stubs of configurable latency, and runs an increasing number of simulated sessions
+through RTWSClient in this process. Each session streams synthetic PCM16 mic audio in real time,
+now and then types a message instead, and periodically gets asked by the stand-in to call a tool.
+
+For every concurrency level it reports the event loop lag, the end-to-end audio latency (from the end of the
+user turn to the first audio chunk of the response reaching the UI handler), CPU and RSS of this process.
+The capacity is the highest level at which the loop lag and audio latency stay within the given limits.
+
+    python benchmarks/load_test.py --sessions 1,5,10,25,50 --duration 30 --output capacity.json
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import random
+import resource
+import subprocess
+import sys
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+import realtime_client  # noqa: E402
+from loop_monitor import monitor  # noqa: E402
+from realtime_client import RTWSClient  # noqa: E402
+from realtime_stub_server import run_server, synthetic_pcm16  # noqa: E402
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of the values, or None if there are none."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, int(round(pct / 100 * len(ordered))) - 1))
+    return ordered[index]
+
+
+def current_rss_mb():
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except OSError:
+        # not on Linux; fall back to the peak RSS (reported in bytes on macOS)
+        max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return max_rss / (1024 * 1024) if sys.platform == "darwin" else max_rss / 1024
+
+
+def install_stub_tools(latency_ms, payload_bytes):
+    """Replaces the tools called by RTWSClient sessions with stubs that block for `latency_ms`, like the real (sync) tools do."""
+
+    def make_stub(name):
+        def stub(**kwargs):
+            time.sleep(latency_ms / 1000)
+            return f"{name} result: " + "x" * payload_bytes
+
+        return stub
+
+    for name in list(realtime_client.available_functions):
+        realtime_client.available_functions[name] = make_stub(name)
+
+
+def serve_stub(host, port, ready, options):
+    asyncio.run(run_server(host, port, ready=ready, **options))
+
+
+class LevelStats:
+    def __init__(self):
+        self.loop_lag_ms = []
+        self.audio_latency_ms = []
+        self.turns = 0
+        self.timeouts = 0
+        self.errors = 0
+
+
+class SimulatedSession:
+    """Plays the part of app.py for one chat: feeds mic audio and typed messages to an RTWSClient."""
+
+    def __init__(self, url, args, stats, rng):
+        self.args = args
+        self.stats = stats
+        self.rng = rng
+        self.client = RTWSClient(system_prompt="load test", url=url)
+        self.client.on("conversation.updated", self.handle_conversation_updated)
+        self.response_done = asyncio.Event()
+        self.turn_ended_at = None
+        self.audio_chunk = synthetic_pcm16(args.chunk_ms)
+
+    def handle_conversation_updated(self, event):
+        if event.get("audio"):
+            if self.turn_ended_at is not None:
+                self.stats.audio_latency_ms.append((time.perf_counter() - self.turn_ended_at) * 1000)
+                self.turn_ended_at = None
+        elif event.get("type") == "response.audio.done":
+            self.response_done.set()
+
+    async def stream_utterance(self):
+        """Streams the user's speech at the pace a microphone would produce it."""
+        chunks = max(1, self.args.utterance_ms // self.args.chunk_ms)
+        start = time.perf_counter()
+        for i in range(chunks):
+            await self.client.append_input_audio(self.audio_chunk)
+            delay = start + (i + 1) * self.args.chunk_ms / 1000 - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+    async def run(self, deadline):
+        # stagger the sessions so that they do not all speak at the same instant
+        await asyncio.sleep(self.rng.uniform(0, self.args.think_ms / 1000))
+        try:
+            await self.client.connect()
+            turn = 0
+            while time.perf_counter() < deadline:
+                turn += 1
+                self.response_done.clear()
+                if self.args.typed_every and turn % self.args.typed_every == 0:
+                    self.turn_ended_at = time.perf_counter()
+                    await self.client.send_user_message_content([{"type": "input_text", "text": "typed question"}])
+                else:
+                    await self.stream_utterance()
+                    self.turn_ended_at = time.perf_counter()
+                    await self.client.send("input_audio_buffer.commit")
+                try:
+                    await asyncio.wait_for(self.response_done.wait(), self.args.response_timeout)
+                    self.stats.turns += 1
+                except asyncio.TimeoutError:
+                    self.stats.timeouts += 1
+                await asyncio.sleep(self.rng.uniform(0.5, 1.5) * self.args.think_ms / 1000)
+        except Exception as e:
+            self.stats.errors += 1
+            print(f"session failed: {e!r}")
+        finally:
+            if self.client.is_connected():
+                await self.client.disconnect()
+
+
+async def sample_loop_lag(samples, interval_ms):
+    loop = asyncio.get_running_loop()
+    while True:
+        start = loop.time()
+        await asyncio.sleep(interval_ms / 1000)
+        samples.append(max(0.0, (loop.time() - start) * 1000 - interval_ms))
+
+
+async def run_level(url, sessions, args, rng):
+    stats = LevelStats()
+    monitor.timings.clear()
+    monitor.stalls.clear()
+    sampler = asyncio.create_task(sample_loop_lag(stats.loop_lag_ms, args.lag_interval_ms))
+    cpu_start, wall_start = time.process_time(), time.perf_counter()
+    deadline = wall_start + args.duration
+    await asyncio.gather(*(SimulatedSession(url, args, stats, rng).run(deadline) for _ in range(sessions)))
+    cpu_pct = (time.process_time() - cpu_start) / (time.perf_counter() - wall_start) * 100
+    sampler.cancel()
+    return {
+        "sessions": sessions,
+        "turns": stats.turns,
+        "timeouts": stats.timeouts,
+        "errors": stats.errors,
+        "loop_lag_ms": {f"p{p}": percentile(stats.loop_lag_ms, p) for p in (50, 95, 99)}
+        | {"max": max(stats.loop_lag_ms, default=None)},
+        "audio_latency_ms": {f"p{p}": percentile(stats.audio_latency_ms, p) for p in (50, 95, 99)},
+        "cpu_pct": cpu_pct,
+        "rss_mb": current_rss_mb(),
+        # time spent in the tools and dispatch handlers, and the callbacks that blocked the loop, if monitored
+        "timings": monitor.snapshot()["timings"],
+        "stalls": [{"label": stall["label"], "blocked_ms": stall["blocked_ms"]} for stall in monitor.stalls],
+    }
+
+
+def within_limits(result, args):
+    lag = result["loop_lag_ms"]["p99"]
+    latency = result["audio_latency_ms"]["p95"]
+    return (
+        result["errors"] == 0
+        and result["timeouts"] == 0
+        and lag is not None
+        and lag <= args.max_loop_lag_ms
+        and latency is not None
+        and latency <= args.max_audio_latency_ms
+    )
+
+
+def format_ms(value):
+    return "-" if value is None else f"{value:.1f}"
+
+
+def release_name():
+    try:
+        return subprocess.run(
+            ["git", "describe", "--always", "--dirty"], cwd=REPO_ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+async def run_levels(url, args):
+    rng = random.Random(args.seed)
+    if args.monitor:
+        monitor.start(args.max_loop_lag_ms)
+    results = []
+    capacity = 0
+    print(f"{'sessions':>8} {'turns':>6} {'lag p50':>8} {'lag p99':>8} {'lat p50':>8} {'lat p95':>8} {'cpu %':>6} {'rss MB':>7}")
+    for sessions in args.sessions:
+        result = await run_level(url, sessions, args, rng)
+        results.append(result)
+        print(
+            f"{sessions:>8} {result['turns']:>6} {format_ms(result['loop_lag_ms']['p50']):>8} "
+            f"{format_ms(result['loop_lag_ms']['p99']):>8} {format_ms(result['audio_latency_ms']['p50']):>8} "
+            f"{format_ms(result['audio_latency_ms']['p95']):>8} {result['cpu_pct']:>6.1f} {result['rss_mb']:>7.1f}"
+        )
+        if not within_limits(result, args):
+            break
+        capacity = sessions
+    return results, capacity
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sessions", default="1,5,10,25,50", help="comma separated concurrency levels to run")
+    parser.add_argument("--duration", type=float, default=30, help="seconds to run each concurrency level for")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--chunk-ms", type=int, default=100, help="duration of each mic audio chunk")
+    parser.add_argument("--utterance-ms", type=int, default=2000, help="duration of each spoken user turn")
+    parser.add_argument("--think-ms", type=int, default=1000, help="average pause between turns")
+    parser.add_argument("--typed-every", type=int, default=4, help="every Nth user turn is typed instead of spoken")
+    parser.add_argument("--tool-every", type=int, default=3, help="every Nth response asks for a tool call")
+    parser.add_argument("--tool-latency-ms", type=int, default=100, help="time each stub tool blocks for")
+    parser.add_argument("--tool-payload-bytes", type=int, default=4000, help="size of each stub tool's output")
+    parser.add_argument("--response-audio-ms", type=int, default=2000, help="duration of each response's audio")
+    parser.add_argument("--response-delay-ms", type=int, default=200, help="stand-in model time to first event")
+    parser.add_argument("--response-timeout", type=float, default=15, help="seconds to wait for a response")
+    parser.add_argument("--lag-interval-ms", type=float, default=10, help="event loop lag sampling interval")
+    parser.add_argument("--max-loop-lag-ms", type=float, default=50, help="p99 loop lag allowed at capacity")
+    parser.add_argument("--max-audio-latency-ms", type=float, default=1500, help="p95 audio latency allowed at capacity")
+    parser.add_argument("--monitor", action="store_true", help="record the stacks of callbacks that block the loop")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    args = parser.parse_args()
+    args.sessions = [int(level) for level in args.sessions.split(",")]
+
+    install_stub_tools(args.tool_latency_ms, args.tool_payload_bytes)
+    ready = multiprocessing.Event()
+    server = multiprocessing.Process(
+        target=serve_stub,
+        args=(
+            "127.0.0.1",
+            args.port,
+            ready,
+            {
+                "response_audio_ms": args.response_audio_ms,
+                "response_delay_ms": args.response_delay_ms,
+                "tool_every": args.tool_every,
+            },
+        ),
+        daemon=True,
+    )
+    server.start()
+    try:
+        if not ready.wait(timeout=10):
+            raise RuntimeError("the stand-in realtime endpoint did not start")
+        results, capacity = asyncio.run(run_levels(f"ws://127.0.0.1:{args.port}/", args))
+    finally:
+        server.terminate()
+
+    print(f"capacity: {capacity} concurrent sessions")
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(
+                {"release": release_name(), "options": vars(args), "levels": results, "capacity": capacity},
+                output,
+                indent=2,
+            )
+
+
+if __name__ == "__main__":
+    main()
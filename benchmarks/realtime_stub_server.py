@@ -0,0 +1,169 @@
+"""
+A local stand-in for the Realtime API endpoint, used to load test the assistant without calling Azure OpenAI.
+
+It speaks enough of the Realtime API protocol for RTWSClient to go through the full life cycle of a conversation:
+- acknowledges session.update
+- on input_audio_buffer.commit, reports the speech as started, committed and transcribed
+- on response.create, either asks for a function call (every `tool_every` responses to a user turn),
+  or streams back a synthetic audio response along with its transcript
+
+Run it standalone with:
+
+    python benchmarks/realtime_stub_server.py --port 8765
+"""
+import argparse
+import asyncio
+import base64
+import itertools
+import json
+import math
+import struct
+
+from websockets.asyncio.server import serve
+
+SAMPLE_RATE = 24000
+
+# sample arguments used when the stand-in asks the client to call one of the tools
+TOOL_CALLS = [
+    ("perform_search_based_qna", {"query": "What is the law of conservation of mass?"}),
+    ("get_mark_status_summary", {"user_name": "Alex"}),
+    ("get_grievance_status_def", {"grievance_id": 10001}),
+    (
+        "register_user_grievance_def",
+        {"grievance_category": "Library issues", "grievance_description": "The library closes too early"},
+    ),
+]
+
+
+def synthetic_pcm16(duration_ms, frequency=440.0):
+    """Returns `duration_ms` of a sine tone as 24kHz mono PCM16 bytes, the format used by the Realtime API."""
+    samples = int(SAMPLE_RATE * duration_ms / 1000)
+    return struct.pack(
+        f"<{samples}h",
+        *(int(8000 * math.sin(2 * math.pi * frequency * i / SAMPLE_RATE)) for i in range(samples)),
+    )
+
+
+class StubRealtimeServer:
+    def __init__(self, response_audio_ms=2000, chunk_ms=100, chunk_interval_ms=10, response_delay_ms=200, tool_every=3):
+        self.response_audio_ms = response_audio_ms
+        self.chunk_ms = chunk_ms
+        # the real service streams audio faster than real time; this is the gap between two audio deltas
+        self.chunk_interval_ms = chunk_interval_ms
+        # time taken by the "model" before the first event of a response
+        self.response_delay_ms = response_delay_ms
+        self.tool_every = tool_every
+        self.audio_chunk = base64.b64encode(synthetic_pcm16(chunk_ms)).decode("utf-8")
+        self._ids = itertools.count(1)
+
+    def _id(self, prefix):
+        return f"{prefix}{next(self._ids)}"
+
+    async def handler(self, websocket):
+        responses = 0
+        tool_calls = itertools.cycle(TOOL_CALLS)
+        pending_tool_output = False
+
+        async def emit(event_type, **data):
+            await websocket.send(json.dumps({"event_id": self._id("event_"), "type": event_type, **data}))
+
+        async for message in websocket:
+            event = json.loads(message)
+            event_type = event["type"]
+            if event_type == "session.update":
+                await emit("session.updated", session=event.get("session", {}))
+            elif event_type == "input_audio_buffer.commit":
+                item_id = self._id("item_")
+                await emit("input_audio_buffer.speech_started", item_id=item_id, audio_start_ms=0)
+                await emit("input_audio_buffer.committed", item_id=item_id, previous_item_id=None)
+                await emit(
+                    "conversation.item.input_audio_transcription.completed",
+                    item_id=item_id,
+                    content_index=0,
+                    transcript="synthetic user question",
+                )
+            elif event_type == "conversation.item.create":
+                item = event.get("item", {})
+                pending_tool_output = item.get("type") == "function_call_output"
+                await emit("conversation.item.created", item={"id": self._id("item_"), **item})
+            elif event_type == "response.create":
+                await asyncio.sleep(self.response_delay_ms / 1000)
+                responses += 1
+                if not pending_tool_output and self.tool_every and responses % self.tool_every == 0:
+                    name, arguments = next(tool_calls)
+                    await self._send_function_call(emit, name, arguments)
+                else:
+                    pending_tool_output = False
+                    await self._send_audio_response(emit)
+
+    async def _send_function_call(self, emit, name, arguments):
+        await emit(
+            "response.done",
+            response={
+                "object": "realtime.response",
+                "id": self._id("resp_"),
+                "status": "completed",
+                "output": [
+                    {
+                        "id": self._id("item_"),
+                        "object": "realtime.item",
+                        "type": "function_call",
+                        "status": "completed",
+                        "name": name,
+                        "call_id": self._id("call_"),
+                        "arguments": json.dumps(arguments),
+                    }
+                ],
+                "usage": {"total_tokens": 0, "input_tokens": 0, "output_tokens": 0},
+            },
+        )
+
+    async def _send_audio_response(self, emit):
+        response_id = self._id("resp_")
+        item_id = self._id("item_")
+        for _ in range(max(1, self.response_audio_ms // self.chunk_ms)):
+            await emit("response.audio.delta", response_id=response_id, item_id=item_id, delta=self.audio_chunk)
+            await emit("response.audio_transcript.delta", response_id=response_id, item_id=item_id, delta="word ")
+            await asyncio.sleep(self.chunk_interval_ms / 1000)
+        await emit("response.audio.done", response_id=response_id, item_id=item_id)
+        await emit(
+            "response.done",
+            response={
+                "object": "realtime.response",
+                "id": response_id,
+                "status": "completed",
+                "output": [{"id": item_id, "object": "realtime.item", "type": "message", "status": "completed"}],
+                "usage": {"total_tokens": 0, "input_tokens": 0, "output_tokens": 0},
+            },
+        )
+
+
+async def run_server(host, port, ready=None, **options):
+    server = StubRealtimeServer(**options)
+    async with serve(server.handler, host, port, max_size=None) as ws_server:
+        if ready is not None:
+            ready.set()
+        await ws_server.serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--response-audio-ms", type=int, default=2000)
+    parser.add_argument("--response-delay-ms", type=int, default=200)
+    parser.add_argument("--tool-every", type=int, default=3)
+    args = parser.parse_args()
+    asyncio.run(
+        run_server(
+            args.host,
+            args.port,
+            response_audio_ms=args.response_audio_ms,
+            response_delay_ms=args.response_delay_ms,
+            tool_every=args.tool_every,
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""
+Measures the memory held per session by a worker, against the local stand-in of the Realtime API.
+
+It reports the growth of RSS and of the Python heap (tracemalloc), divided by the number of sessions, for:
+- chats that have a realtime client, but have not started talking
+- idle sessions, with an open realtime connection
+- active sessions, while each is going through a spoken turn and its response
+
+    python benchmarks/session_memory.py --sessions 200
+"""
+import argparse
+import asyncio
+import gc
+import multiprocessing
+import os
+import sys
+import tracemalloc
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+from load_test import SimulatedSession, current_rss_mb, install_stub_tools, serve_stub  # noqa: E402
+
+
+def measure():
+    gc.collect()
+    return current_rss_mb(), tracemalloc.get_traced_memory()[0] / (1024 * 1024)
+
+
+class _NoStats:
+    """SimulatedSession records latencies; they are not needed to measure memory."""
+
+    def __init__(self):
+        self.audio_latency_ms = []
+
+
+async def run(url, args):
+    tracemalloc.start()
+    results = []
+    baseline = measure()
+
+    def report(phase):
+        rss, heap = measure()
+        results.append(
+            (phase, (rss - baseline[0]) * 1024 / args.sessions, (heap - baseline[1]) * 1024 / args.sessions)
+        )
+
+    stats = _NoStats()
+    sessions = [SimulatedSession(url, args, stats=stats, rng=None) for _ in range(args.sessions)]
+    report("chat, not connected")
+
+    for session in sessions:
+        await session.client.connect()
+    # let the session.update round trips settle
+    await asyncio.sleep(1)
+    report("idle realtime session")
+
+    async def one_turn(session):
+        session.response_done.clear()
+        await session.stream_utterance()
+        await session.client.send("input_audio_buffer.commit")
+        await asyncio.wait_for(session.response_done.wait(), args.response_timeout)
+
+    turns = asyncio.gather(*(one_turn(session) for session in sessions))
+    # sample while the responses are streaming back
+    await asyncio.sleep(args.utterance_ms / 1000 + args.response_delay_ms / 1000 + 0.5)
+    report("active realtime session")
+    await turns
+
+    for session in sessions:
+        await session.client.disconnect()
+    tracemalloc.stop()
+
+    print(f"{'':<26} {'RSS KB/session':>15} {'heap KB/session':>16}")
+    for phase, rss_kb, heap_kb in results:
+        print(f"{phase:<26} {rss_kb:>15.1f} {heap_kb:>16.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sessions", type=int, default=100)
+    parser.add_argument("--port", type=int, default=8766)
+    parser.add_argument("--chunk-ms", type=int, default=100)
+    parser.add_argument("--utterance-ms", type=int, default=2000)
+    parser.add_argument("--response-audio-ms", type=int, default=4000)
+    parser.add_argument("--response-delay-ms", type=int, default=200)
+    parser.add_argument("--response-timeout", type=float, default=60)
+    args = parser.parse_args()
+
+    install_stub_tools(latency_ms=0, payload_bytes=0)
+    ready = multiprocessing.Event()
+    server = multiprocessing.Process(
+        target=serve_stub,
+        args=(
+            "127.0.0.1",
+            args.port,
+            ready,
+            {
+                "response_audio_ms": args.response_audio_ms,
+                "response_delay_ms": args.response_delay_ms,
+                # every turn gets an audio response, so that all the active sessions are alike
+                "tool_every": 0,
+                # stream the audio at about real time, so that the sessions are sampled mid-response
+                "chunk_interval_ms": 100,
+            },
+        ),
+        daemon=True,
+    )
+    server.start()
+    try:
+        if not ready.wait(timeout=10):
+            raise RuntimeError("the stand-in realtime endpoint did not start")
+        asyncio.run(run(f"ws://127.0.0.1:{args.port}/", args))
+    finally:
+        server.terminate()
+
+
+if __name__ == "__main__":
+    main()
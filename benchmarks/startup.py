@@ -0,0 +1,75 @@
+"""
+Measures the process startup time of the assistant, and the time taken to set up the first session.
+
+Each measurement runs in a fresh interpreter, so that the module cache of one run does not affect the next.
+Run it from the root of the repository, on the commit to compare against and on the current one:
+
+    python benchmarks/startup.py --runs 10
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# import of the realtime client, which is what app.py pulls in when chainlit loads it
+IMPORT_SNIPPET = """
+import time, json
+start = time.perf_counter()
+import realtime_client
+print(json.dumps({"import_ms": (time.perf_counter() - start) * 1000}))
+"""
+
+# the first session: creating the client and serializing the session.update payload sent on connect,
+# followed by loading the client libraries of the tools (what the first tool call of the process pays for)
+FIRST_SESSION_SNIPPET = """
+import time, json
+import realtime_client
+start = time.perf_counter()
+client = realtime_client.RTWSClient(system_prompt="benchmark")
+json.dumps({"type": "session.update", "session": dict(client.session_config)})
+session_ms = (time.perf_counter() - start) * 1000
+start = time.perf_counter()
+try:
+    from tools import warm_up
+    warm_up()
+except ImportError:
+    # trees without the tool registry import the tool libraries along with realtime_client
+    pass
+print(json.dumps({"first_session_ms": session_ms, "tool_libraries_ms": (time.perf_counter() - start) * 1000}))
+"""
+
+
+def run_snippet(snippet):
+    output = subprocess.run(
+        [sys.executable, "-c", snippet],
+        cwd=REPO_ROOT,
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5, help="number of fresh interpreters to measure")
+    args = parser.parse_args()
+
+    samples = {}
+    for _ in range(args.runs):
+        for snippet in (IMPORT_SNIPPET, FIRST_SESSION_SNIPPET):
+            for key, value in run_snippet(snippet).items():
+                samples.setdefault(key, []).append(value)
+
+    for key, values in samples.items():
+        print(
+            f"{key:<20} median {statistics.median(values):8.1f}  min {min(values):8.1f}  max {max(values):8.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,239 @@
+"""
+Admission control for the realtime sessions of a worker, and concurrency limits for the backends called by the tools.
+
+- session_admission caps the number of open realtime sessions. Sessions beyond the cap wait in a first-come,
+  first-served queue of bounded length, and are turned away when the queue is full or their wait times out.
+- backend_limits caps the number of concurrent calls to each backend (SQL, Jira, AI Search). The tools run on
+  the threads of tool_executor, sized to the sum of the backend limits; a call that cannot get a slot within
+  the wait timeout fails with BackendBusy.
+"""
+import asyncio
+import collections
+import concurrent.futures
+import threading
+import time
+from envconfig import DefaultConfig
+
+
+class SessionAdmission:
+    def __init__(self, max_sessions, max_waiting, wait_timeout):
+        self.max_sessions = max_sessions
+        self.max_waiting = max_waiting
+        self.wait_timeout = wait_timeout
+        self.active = 0
+        self._waiters = collections.deque()
+        self.admitted = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self.max_wait_ms = 0.0
+
+    def is_full(self):
+        return self.active >= self.max_sessions
+
+    async def acquire(self, on_queued=None):
+        """
+        Waits for a free session slot. Returns True once admitted, or False if the session is turned away.
+        :param on_queued: coroutine function called with the position in the queue, if the session has to wait
+        """
+        if self.active < self.max_sessions and not self._waiters:
+            self.active += 1
+            self.admitted += 1
+            return True
+        if len(self._waiters) >= self.max_waiting:
+            self.rejected += 1
+            return False
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.append(future)
+        start = time.monotonic()
+        try:
+            if on_queued:
+                await on_queued(len(self._waiters))
+            await asyncio.wait({future}, timeout=self.wait_timeout)
+        except asyncio.CancelledError:
+            # the user left while waiting. Give back the slot, if it was handed over in the meantime
+            if future.done():
+                self.release()
+            else:
+                self._remove(future)
+            raise
+        if not future.done():
+            self._remove(future)
+            self.timed_out += 1
+            return False
+        # the slot was handed over by release()
+        self.max_wait_ms = max(self.max_wait_ms, (time.monotonic() - start) * 1000)
+        return True
+
+    def _remove(self, future):
+        future.cancel()
+        try:
+            self._waiters.remove(future)
+        except ValueError:
+            pass
+
+    def release(self):
+        """Frees the slot of a session, handing it over to the longest waiting session if there is one."""
+        while self._waiters:
+            future = self._waiters.popleft()
+            if not future.done():
+                future.set_result(None)
+                self.admitted += 1
+                return
+        self.active = max(0, self.active - 1)
+
+    def snapshot(self):
+        return {
+            "active": self.active,
+            "max_sessions": self.max_sessions,
+            "waiting": len(self._waiters),
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "timed_out": self.timed_out,
+            "max_wait_ms": round(self.max_wait_ms, 1),
+        }
+
+
+class BackendBusy(Exception):
+    pass
+
+
+class BackendLimiter:
+    """Limits the concurrent calls to a backend, across the threads the tools run on."""
+
+    def __init__(self, name, max_concurrent, wait_timeout):
+        self.name = name
+        self.max_concurrent = max_concurrent
+        self.wait_timeout = wait_timeout
+        self._semaphore = threading.BoundedSemaphore(max_concurrent)
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.waiting = 0
+        self.max_waiting = 0
+        self.calls = 0
+        self.rejected = 0
+        self.total_wait_ms = 0.0
+        self.max_wait_ms = 0.0
+
+    def __enter__(self):
+        with self._lock:
+            self.waiting += 1
+            self.max_waiting = max(self.max_waiting, self.waiting)
+        start = time.perf_counter()
+        acquired = self._semaphore.acquire(timeout=self.wait_timeout)
+        waited_ms = (time.perf_counter() - start) * 1000
+        with self._lock:
+            self.waiting -= 1
+            if acquired:
+                self.in_flight += 1
+                self.calls += 1
+                self.total_wait_ms += waited_ms
+                self.max_wait_ms = max(self.max_wait_ms, waited_ms)
+            else:
+                self.rejected += 1
+        if not acquired:
+            raise BackendBusy(f"{self.name} is busy, no slot became free in {self.wait_timeout} seconds")
+        return self
+
+    def __exit__(self, *exc_info):
+        with self._lock:
+            self.in_flight -= 1
+        self._semaphore.release()
+        return False
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "in_flight": self.in_flight,
+                "max_concurrent": self.max_concurrent,
+                "waiting": self.waiting,
+                "max_waiting": self.max_waiting,
+                "calls": self.calls,
+                "rejected": self.rejected,
+                "avg_wait_ms": round(self.total_wait_ms / self.calls, 1) if self.calls else 0.0,
+                "max_wait_ms": round(self.max_wait_ms, 1),
+            }
+
+
+class ToolExecutor:
+    """Runs the tools on a dedicated thread pool, keeping count of the calls waiting for a thread."""
+
+    def __init__(self, max_workers):
+        self.max_workers = max_workers
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="tool")
+        self._lock = threading.Lock()
+        self.queued = 0
+        self.max_queued = 0
+        self.running = 0
+        self.calls = 0
+        self.total_wait_ms = 0.0
+        self.max_wait_ms = 0.0
+
+    async def run(self, func, **kwargs):
+        started = False
+        submitted = time.perf_counter()
+
+        def call():
+            nonlocal started
+            waited_ms = (time.perf_counter() - submitted) * 1000
+            with self._lock:
+                started = True
+                self.queued -= 1
+                self.running += 1
+                self.total_wait_ms += waited_ms
+                self.max_wait_ms = max(self.max_wait_ms, waited_ms)
+            try:
+                return func(**kwargs)
+            finally:
+                with self._lock:
+                    self.running -= 1
+
+        with self._lock:
+            self.queued += 1
+            self.calls += 1
+            self.max_queued = max(self.max_queued, self.queued)
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._executor, call)
+        except asyncio.CancelledError:
+            with self._lock:
+                # the call was dropped from the queue before a thread picked it up
+                if not started:
+                    self.queued -= 1
+            raise
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "threads": self.max_workers,
+                "running": self.running,
+                "queued": self.queued,
+                "max_queued": self.max_queued,
+                "calls": self.calls,
+                "avg_wait_ms": round(self.total_wait_ms / self.calls, 1) if self.calls else 0.0,
+                "max_wait_ms": round(self.max_wait_ms, 1),
+            }
+
+
+session_admission = SessionAdmission(
+    DefaultConfig.max_realtime_sessions,
+    DefaultConfig.admission_queue_size,
+    DefaultConfig.admission_wait_timeout_seconds,
+)
+
+backend_limits = {
+    "sql": BackendLimiter("sql", DefaultConfig.sql_max_concurrency, DefaultConfig.backend_wait_timeout_seconds),
+    "jira": BackendLimiter("jira", DefaultConfig.jira_max_concurrency, DefaultConfig.backend_wait_timeout_seconds),
+    "search": BackendLimiter(
+        "search", DefaultConfig.search_max_concurrency, DefaultConfig.backend_wait_timeout_seconds
+    ),
+}
+
+
+tool_executor = ToolExecutor(sum(limiter.max_concurrent for limiter in backend_limits.values()))
+
+
+def snapshot():
+    return {
+        "sessions": session_admission.snapshot(),
+        "tools": tool_executor.snapshot(),
+        "backends": {name: limiter.snapshot() for name, limiter in backend_limits.items()},
+    }
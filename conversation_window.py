@@ -0,0 +1,164 @@
+"""
+Keeps the conversation held by the Realtime API server within a budget, so that the input tokens of each
+turn (and with them the time to first audio) stop growing over a long session.
+
+ConversationWindow tracks the items of the server-side conversation, and an estimate of their size, from the
+events the server sends. Once the conversation holds more items or estimated tokens than the policy allows,
+the oldest turns are pruned, keeping the last `keep_last_turns` turns. Pruned turns are either deleted, or
+deleted and folded into a summary message placed at the start of the conversation. The system prompt is part
+of the session instructions rather than the conversation, and is always kept.
+"""
+import collections
+
+SUMMARY_ITEM_PREFIX = "summary_"
+
+# rough sizes used for the estimates: ~4 characters per text token; audio input takes ~1 token per 100 ms,
+# and audio output ~1 token per 50 ms. The PCM16 audio at 24kHz is 48 bytes per ms
+CHARS_PER_TOKEN = 4
+INPUT_AUDIO_MS_PER_TOKEN = 100
+OUTPUT_AUDIO_MS_PER_TOKEN = 50
+PCM16_BYTES_PER_MS = 48
+
+
+class ConversationItem:
+    __slots__ = ("id", "type", "role", "text", "name", "audio_ms")
+
+    def __init__(self, item_id, item_type, role, text="", name=None):
+        self.id = item_id
+        self.type = item_type
+        self.role = role
+        self.text = text
+        self.name = name
+        self.audio_ms = 0
+
+    @property
+    def tokens(self):
+        audio_ms_per_token = INPUT_AUDIO_MS_PER_TOKEN if self.role == "user" else OUTPUT_AUDIO_MS_PER_TOKEN
+        return len(self.text) // CHARS_PER_TOKEN + self.audio_ms // audio_ms_per_token
+
+    def starts_turn(self):
+        return self.type == "message" and self.role == "user"
+
+
+def _item_text(item):
+    if item.get("type") == "function_call_output":
+        return item.get("output") or ""
+    if item.get("type") == "function_call":
+        return item.get("arguments") or ""
+    parts = []
+    for part in item.get("content") or []:
+        parts.append(part.get("text") or part.get("transcript") or "")
+    return " ".join(part for part in parts if part)
+
+
+class ConversationWindow:
+    def __init__(self, mode="summarize", max_items=60, max_tokens=6000, keep_last_turns=4, summary_max_chars=2000):
+        self.mode = mode
+        self.max_items = max_items
+        self.max_tokens = max_tokens
+        self.keep_last_turns = keep_last_turns
+        self.summary_max_chars = summary_max_chars
+        self.items = collections.OrderedDict()
+        self.summary = ""
+        self._summaries = 0
+        self._speech_started_ms = {}
+        # duration of the user speech by item id. The server reports the speech as stopped before it creates the item
+        self._speech_ms = {}
+        # input tokens reported by the server for the last responses, to see the effect of the pruning
+        self.input_tokens = collections.deque(maxlen=50)
+
+    @property
+    def total_tokens(self):
+        return sum(item.tokens for item in self.items.values())
+
+    def track(self, event):
+        """Updates the tracked conversation from a server event."""
+        event_type = event.get("type")
+        if event_type == "conversation.item.created":
+            item = event.get("item", {})
+            tracked = ConversationItem(item["id"], item.get("type"), item.get("role"), _item_text(item), item.get("name"))
+            tracked.audio_ms = self._speech_ms.pop(item["id"], 0)
+            self.items[item["id"]] = tracked
+            if item["id"].startswith(SUMMARY_ITEM_PREFIX):
+                # the summary is created at the start of the conversation
+                self.items.move_to_end(item["id"], last=False)
+        elif event_type == "conversation.item.deleted":
+            self.items.pop(event.get("item_id"), None)
+            self._speech_ms.pop(event.get("item_id"), None)
+        elif event_type == "input_audio_buffer.speech_started":
+            self._speech_started_ms[event.get("item_id")] = event.get("audio_start_ms", 0)
+        elif event_type == "input_audio_buffer.speech_stopped":
+            started_ms = self._speech_started_ms.pop(event.get("item_id"), None)
+            if started_ms is not None:
+                speech_ms = event.get("audio_end_ms", started_ms) - started_ms
+                item = self.items.get(event.get("item_id"))
+                if item is not None:
+                    item.audio_ms = speech_ms
+                else:
+                    self._speech_ms[event.get("item_id")] = speech_ms
+        elif event_type == "conversation.item.input_audio_transcription.completed":
+            item = self.items.get(event.get("item_id"))
+            if item is not None:
+                item.text = event.get("transcript") or ""
+        elif event_type == "response.audio.delta":
+            item = self.items.get(event.get("item_id"))
+            if item is not None:
+                # size of the decoded audio, without decoding the base64
+                item.audio_ms += len(event.get("delta", "")) * 3 // 4 // PCM16_BYTES_PER_MS
+        elif event_type in ("response.audio_transcript.done", "response.text.done"):
+            item = self.items.get(event.get("item_id"))
+            if item is not None:
+                item.text = event.get("transcript") or event.get("text") or ""
+        elif event_type == "response.done":
+            usage = event.get("response", {}).get("usage") or {}
+            if "input_tokens" in usage:
+                self.input_tokens.append(usage["input_tokens"])
+
+    def is_over_budget(self):
+        return len(self.items) > self.max_items or self.total_tokens > self.max_tokens
+
+    def prune(self):
+        """
+        Picks the items to prune, if the conversation is over its budget, and removes them from the tracked
+        conversation. Returns the ids of the items to delete on the server, and the summary item to create in
+        their place (None when the policy deletes without summarizing, or there is nothing to prune).
+        """
+        if not self.is_over_budget():
+            return [], None
+        turn_starts = [item_id for item_id, item in self.items.items() if item.starts_turn()]
+        if len(turn_starts) <= self.keep_last_turns:
+            return [], None
+        first_kept = turn_starts[-self.keep_last_turns] if self.keep_last_turns else None
+        pruned = []
+        for item_id in list(self.items):
+            if item_id == first_kept:
+                break
+            pruned.append(self.items.pop(item_id))
+        if not pruned:
+            return [], None
+        if self.mode != "summarize":
+            return [item.id for item in pruned], None
+
+        lines = [self.summary] if self.summary else []
+        for item in pruned:
+            if item.id.startswith(SUMMARY_ITEM_PREFIX):
+                continue
+            if item.type == "message" and item.text:
+                lines.append(f"{item.role}: {item.text}")
+            elif item.type == "function_call":
+                lines.append(f"(the assistant looked up {item.name})")
+        # keep the most recent part of the summary when it grows beyond its budget
+        self.summary = "\n".join(lines)[-self.summary_max_chars :]
+        self._summaries += 1
+        summary_item = {
+            "id": f"{SUMMARY_ITEM_PREFIX}{self._summaries}",
+            "type": "message",
+            "role": "system",
+            "content": [
+                {
+                    "type": "input_text",
+                    "text": "Summary of the earlier part of the conversation with the user:\n" + self.summary,
+                }
+            ],
+        }
+        return [item.id for item in pruned], summary_item
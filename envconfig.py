@@ -27,6 +27,12 @@ class DefaultConfig:
     grievance_type=os.getenv("grievance_type")
     grievance_project_name=os.getenv("grievance_project_name")
 
+    # local queue the grievances are stored in, before they are submitted to Jira in batches by a background thread
+    grievance_queue_db = os.getenv("grievance_queue_db", "grievances.db")
+    grievance_batch_size = int(os.getenv("grievance_batch_size", "50"))
+    grievance_submit_interval_seconds = float(os.getenv("grievance_submit_interval_seconds", "5"))
+    grievance_max_attempts = int(os.getenv("grievance_max_attempts", "8"))
+
 
     ai_assistant_organization_name = "Contoso Education Services."
 
@@ -35,3 +41,38 @@ class DefaultConfig:
     az_db_database=os.getenv("az_db_database")
     az_db_username=os.getenv("az_db_username")
     az_db_password=os.getenv("az_db_password")
+
+    # import the client libraries used by the tools when the first chat starts, instead of on the first tool call
+    tools_warm_up = os.getenv("tools_warm_up", "false").lower() == "true"
+
+    # event loop monitor. Reports callbacks that block the loop for longer than loop_monitor_slow_callback_ms
+    loop_monitor_enabled = os.getenv("loop_monitor_enabled", "false").lower() == "true"
+    loop_monitor_slow_callback_ms = float(os.getenv("loop_monitor_slow_callback_ms", "100"))
+    loop_monitor_profile_dir = os.getenv("loop_monitor_profile_dir", "profiles")
+
+    # when set, the events of every realtime session are recorded to this directory, for replay with session_recorder.py
+    session_recording_dir = os.getenv("session_recording_dir")
+
+    # the admin endpoints (event loop monitor, capacity statistics) are enabled only when a token is set
+    admin_token = os.getenv("admin_token")
+
+    # admission control: the realtime sessions a worker keeps open, and how many more can wait for a slot
+    max_realtime_sessions = int(os.getenv("max_realtime_sessions", "50"))
+    admission_queue_size = int(os.getenv("admission_queue_size", "20"))
+    admission_wait_timeout_seconds = float(os.getenv("admission_wait_timeout_seconds", "30"))
+
+    # pruning of the server-side conversation: "summarize" replaces the oldest turns with a summary of their transcripts,
+    # "delete" drops them, and "off" keeps the whole conversation. The last turns are always kept
+    conversation_pruning = os.getenv("conversation_pruning", "summarize")
+    conversation_max_items = int(os.getenv("conversation_max_items", "60"))
+    conversation_max_tokens = int(os.getenv("conversation_max_tokens", "6000"))
+    conversation_keep_last_turns = max(1, int(os.getenv("conversation_keep_last_turns", "4")))
+
+    # realtime connections with no events sent or received for this long are closed (0 keeps them open)
+    session_idle_timeout_seconds = float(os.getenv("session_idle_timeout_seconds", "300"))
+
+    # the concurrent calls the tools make to each backend
+    sql_max_concurrency = int(os.getenv("sql_max_concurrency", "5"))
+    jira_max_concurrency = int(os.getenv("jira_max_concurrency", "5"))
+    search_max_concurrency = int(os.getenv("search_max_concurrency", "10"))
+    backend_wait_timeout_seconds = float(os.getenv("backend_wait_timeout_seconds", "10"))
@@ -1,11 +1,26 @@
 from chainlit.logger import logger
 from envconfig import DefaultConfig
-import pyodbc
-from azure.core.credentials import AzureKeyCredential
-from azure.search.documents import SearchClient
-from atlassian import Jira
+from tool_registry import tool
+from capacity import backend_limits, BackendBusy
+from grievance_queue import default_jira_client, get_grievance_queue, PENDING, SUBMITTED
 
+# The client libraries for Azure AI Search, Jira and SQL Server are slow to import, and are
+# hence imported on the first call to the tools that need them (or when tool_registry.warm_up() is called)
+
+
+@tool(
+    description="call this function to respond to the user query on subjects like Accountancy, Chemistry & Physics, based on the course material.",
+    parameters={
+        "type": "object",
+        "properties": {"query": {"type": "string"}},
+        "required": ["query"],
+    },
+    requires=("azure.core.credentials", "azure.search.documents"),
+)
 def perform_search_based_qna(query):
+    from azure.core.credentials import AzureKeyCredential
+    from azure.search.documents import SearchClient
+
     logger.info("calling search to get context for the response ....")
     credential = AzureKeyCredential(DefaultConfig.ai_search_key)
     client = SearchClient(
@@ -13,14 +28,19 @@ def perform_search_based_qna(query):
         index_name=DefaultConfig.ai_index_name,
         credential=credential,
     )
-    response = client.search(
-        search_text=query,
-        query_type="semantic",
-        semantic_configuration_name=DefaultConfig.ai_semantic_config,
-    )
+    try:
+        with backend_limits["search"]:
+            response = client.search(
+                search_text=query,
+                query_type="semantic",
+                semantic_configuration_name=DefaultConfig.ai_semantic_config,
+            )
+            results = list(response)
+    except BackendBusy as e:
+        logger.warning(f"Search skipped: {e}")
+        return "The course material search is busy right now. Please ask the user to try again in a little while"
     response_docs = ""
     counter = 0
-    results = list(response)
     for result in results:
         logger.info(f"search result from document: {result['title']}\n {result['chunk']}  ")
         response_docs += (
@@ -35,6 +55,8 @@ def perform_search_based_qna(query):
     return response_docs
 
 def init_jira_connection():
+    from atlassian import Jira
+
     l_jira = None
     try:
         l_jira = Jira(
@@ -51,13 +73,46 @@ def init_jira_connection():
         logger.error("Exiting the program....")
         exit(1)
 
+@tool(
+    description="fetch real time grievance status for a grievance reference or id",
+    parameters={
+        "type": "object",
+        "properties": {
+            "grievance_id": {
+                "type": "string",
+                "description": "The grievance reference (like GRV-3FA9C1) or grievance id of the user registered in the Grievance System",
+            }
+        },
+        "required": ["grievance_id"],
+    },
+    requires=("atlassian",),
+)
 def get_grievance_status_def(grievance_id):
     response_message = ""
     response = ""
-    JQL = "project = " + DefaultConfig.grievance_project_name + " AND id = " + str(grievance_id)
-    l_jira = init_jira_connection()
     try:
-        response_message = l_jira.jql(JQL)
+        # the grievance could be one registered in the local queue, and not yet (or never) submitted to Jira
+        grievance = get_grievance_queue().lookup(grievance_id)
+        if grievance and grievance["status"] == PENDING:
+            return (
+                f"The grievance {grievance['reference']} has been registered, and is being forwarded to the team that will handle it."
+                " Its status will be available shortly."
+            )
+        if grievance and grievance["status"] != SUBMITTED:
+            return (
+                f"The grievance {grievance['reference']} has been registered, but is taking longer than usual to reach the team,"
+                " as the grievance system is unavailable. It is stored safely, and will be forwarded as soon as the system is back."
+            )
+        if grievance:
+            JQL = "project = " + DefaultConfig.grievance_project_name + " AND id = " + grievance["jira_id"]
+        elif str(grievance_id).strip().isdigit():
+            JQL = "project = " + DefaultConfig.grievance_project_name + " AND id = " + str(grievance_id).strip()
+        else:
+            return "sorry, we could not locate a grievance with this ID. Can you please verify your input again?"
+        with backend_limits["jira"]:
+            # no connection check here: a failure to reach Jira is reported to the user below, like any other error
+            l_jira = default_jira_client()
+            response_message = l_jira.jql(JQL)
         logger.info("Issue status retrieved successfully!")
         logger.info("grievance status response .. ", response_message)
         if response_message["issues"]:
@@ -85,60 +140,101 @@ def get_grievance_status_def(grievance_id):
                 response += "\ndue date : not assigned by the system yet."
         else:
             response = "sorry, we could not locate a grievance with this ID. Can you please verify your input again?"
+    except BackendBusy as e:
+        logger.warning(f"Grievance status lookup skipped: {e}")
+        response = "The grievance system is busy right now. Please ask the user to try again in a little while"
     except Exception as e:
         logger.error(f"Error retrieving the grievance: {e.args[0]}")
         response = "We had an issue retrieving your grievance status. Please check back in some time"
     return response
 
+@tool(
+    description="register a grievance, or complaint or issue from the user in the college facilities, academics system",
+    parameters={
+        "type": "object",
+        "properties": {
+            "grievance_category": {
+                "type": "string",
+                "enum": [
+                    "facilities issues",
+                    "Exams issues",
+                    "Onboarding issues",
+                    "Library issues",
+                    "other issues",
+                ],
+            },
+            "grievance_description": {
+                "type": "string",
+                "description": "The detailed description of the grievance faced by the user",
+            },
+        },
+        "required": ["grievance_category", "grievance_description"],
+    },
+    requires=("atlassian",),
+)
 def register_user_grievance_def(grievance_category, grievance_description):
     response_message = ""
     try:
-        issue_details = {
-            "project": {"key": DefaultConfig.grievance_project_key},
-            "summary": grievance_category,
-            "description": grievance_description,
-            "issuetype": {"name": "Task"},
-        }
-        l_jira = init_jira_connection()
-        response = l_jira.create_issue(fields=issue_details)
+        # the grievance is stored locally and submitted to Jira in the background, so the user does not wait on Jira
+        reference = get_grievance_queue().enqueue(grievance_category, grievance_description)
         response_message = (
-            "We are sorry about the issue you are facing. We have registered a grievance with id "
-            + response["id"]
+            "We are sorry about the issue you are facing. We have registered a grievance with reference "
+            + reference
             + " to track it to closure. Please quote that in your future communications with us"
         )
-        logger.info("Issue created successfully!")
+        logger.info(f"Grievance {reference} registered")
     except Exception as e:
         logger.error(f"Error registering the grievance issue: {e.args[0]}")
         response_message = "We had an issue registering your grievance. Please check back in some time"
     return response_message
 
+@tool(
+    description="retrieve the mark status summary for a student based on the user name",
+    parameters={
+        "type": "object",
+        "properties": {
+            "user_name": {
+                "type": "string",
+                "description": "The user name of the student registered in the College System",
+            }
+        },
+        "required": ["user_name"],
+    },
+    requires=("pyodbc",),
+)
 def get_mark_status_summary(user_name):
+    import pyodbc
+
     response_message = ""
     cursor = None
     logger.info(f"calling the database to fetch mark status summary for student {user_name}")
     l_connection = None
     try:
-        l_connection = pyodbc.connect(
-            "Driver={ODBC Driver 18 for SQL Server};SERVER="
-            + DefaultConfig.az_db_server
-            + ";DATABASE="
-            + DefaultConfig.az_db_database
-            + ";UID="
-            + DefaultConfig.az_db_username
-            + ";PWD="
-            + DefaultConfig.az_db_password
-        )
-        cursor = l_connection.cursor()
-        query = "SELECT [StudentID],[Name],[Branch],[Semester],[Subject],[Score],[Grade],[Attendance] FROM StudentAcademics WHERE Name = ?;"
-        cursor.execute(query, user_name)
-        table_header = "| StudentID| Name | Branch | Semester | Subject |Score |Grade |Attendance|\n"
-        table_separator = "| --- | --- | --- | --- | --- |---|---|---| \n"
-        table_rows = ""
-        for row in cursor:
-            table_rows += f"| {row[0]} | {row[1]} | {row[2]} | {row[3]} | {row[4]} |{row[5]} |{row[6]} |{row[7]} |\n"
-        markdown_table = table_header + table_separator + table_rows
-        l_connection.close()
+        with backend_limits["sql"]:
+            l_connection = pyodbc.connect(
+                "Driver={ODBC Driver 18 for SQL Server};SERVER="
+                + DefaultConfig.az_db_server
+                + ";DATABASE="
+                + DefaultConfig.az_db_database
+                + ";UID="
+                + DefaultConfig.az_db_username
+                + ";PWD="
+                + DefaultConfig.az_db_password
+            )
+            cursor = l_connection.cursor()
+            query = "SELECT [StudentID],[Name],[Branch],[Semester],[Subject],[Score],[Grade],[Attendance] FROM StudentAcademics WHERE Name = ?;"
+            cursor.execute(query, user_name)
+            table_header = "| StudentID| Name | Branch | Semester | Subject |Score |Grade |Attendance|\n"
+            table_separator = "| --- | --- | --- | --- | --- |---|---|---| \n"
+            table_rows = ""
+            for row in cursor:
+                table_rows += f"| {row[0]} | {row[1]} | {row[2]} | {row[3]} | {row[4]} |{row[5]} |{row[6]} |{row[7]} |\n"
+            markdown_table = table_header + table_separator + table_rows
+            l_connection.close()
         return markdown_table
+    except BackendBusy as e:
+        logger.warning(f"Mark status query skipped: {e}")
+        return "The student records system is busy right now. Please ask the user to try again in a little while"
     except Exception as e:
         logger.error(f"Error in database query execution: {e}")
         response_message = "We had an issue retrieving your mark status. Please check back in some time"
@@ -146,6 +242,8 @@ def get_mark_status_summary(user_name):
 
 
 def init_database_connection() -> any:
+    import pyodbc
+
     l_connection = None
     try:
         l_connection = pyodbc.connect(
@@ -165,10 +263,3 @@ def init_database_connection() -> any:
         logger.error(f"Error connecting to the database: {e}")
         logger.error("Exiting the program....")
         exit(1)
-
-available_functions = {
-    "perform_search_based_qna": perform_search_based_qna,
-    "get_mark_status_summary": get_mark_status_summary,
-    "get_grievance_status_def": get_grievance_status_def,
-    "register_user_grievance_def": register_user_grievance_def,
-}
@@ -0,0 +1,261 @@
+"""
+Durable write-behind queue for the grievances registered by the users.
+
+Registering a grievance stores it in a local SQLite database and returns a stable reference (e.g. GRV-3FA9C1)
+right away, so the voice turn does not wait on Jira. A background thread submits the pending grievances to
+Jira in batches, through its bulk create endpoint, retrying with backoff when Jira is slow or down. A grievance
+that is still not submitted after `max_attempts` attempts is marked failed, so that it shows up in the stats and
+the logs, and is still retried every 5 minutes until Jira takes it.
+
+Each grievance carries an idempotency key, added to its Jira issue as a label. An attempt is recorded before
+Jira is called, and before a grievance is attempted again, the issue already created for it (e.g. when Jira
+timed out, or the worker stopped, after creating it) is looked up by label, so that a grievance is never
+created twice. The local reference is mapped to the Jira issue once it is created, so the
+grievance status can be looked up with either of them.
+"""
+import secrets
+import sqlite3
+import threading
+import time
+import uuid
+from chainlit.logger import logger
+from envconfig import DefaultConfig
+from capacity import backend_limits
+
+PENDING = "pending"
+SUBMITTED = "submitted"
+# still retried, at the longest backoff, but overdue
+FAILED = "failed"
+
+MAX_BACKOFF_SECONDS = 300
+
+# the bulk create endpoint of Jira accepts at most 50 issues per call
+JIRA_BULK_LIMIT = 50
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS grievances (
+    reference TEXT PRIMARY KEY,
+    idempotency_key TEXT NOT NULL UNIQUE,
+    category TEXT NOT NULL,
+    description TEXT NOT NULL,
+    status TEXT NOT NULL,
+    jira_id TEXT,
+    jira_key TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    last_error TEXT,
+    next_attempt_at REAL NOT NULL,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS grievances_pending ON grievances (status, next_attempt_at);
+CREATE INDEX IF NOT EXISTS grievances_jira_id ON grievances (jira_id);
+"""
+
+
+def idempotency_label(idempotency_key):
+    return f"grievance-{idempotency_key}"
+
+
+class GrievanceQueue:
+    def __init__(self, db_path, jira_factory=None, batch_size=JIRA_BULK_LIMIT, submit_interval=5, max_attempts=8):
+        self.db_path = db_path
+        # creates the Jira client used by the submitter. Defaults to the one in the configuration;
+        # pass a factory to submit to another (e.g. a local fake) Jira
+        self.jira_factory = jira_factory or default_jira_client
+        self.batch_size = min(batch_size, JIRA_BULK_LIMIT)
+        self.submit_interval = submit_interval
+        self.max_attempts = max_attempts
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self._connection.row_factory = sqlite3.Row
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.executescript(SCHEMA)
+        self._wake_up = threading.Event()
+        self._stopped = threading.Event()
+        self._submitter = None
+        self._jira = None
+
+    def _execute(self, sql, parameters=()):
+        with self._lock:
+            return self._connection.execute(sql, parameters).fetchall()
+
+    def enqueue(self, category, description):
+        """Stores a grievance to be submitted to Jira, and returns its reference."""
+        now = time.time()
+        while True:
+            reference = f"GRV-{secrets.token_hex(3).upper()}"
+            try:
+                self._execute(
+                    "INSERT INTO grievances (reference, idempotency_key, category, description, status,"
+                    " next_attempt_at, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (reference, uuid.uuid4().hex, category, description, PENDING, now, now, now),
+                )
+                break
+            except sqlite3.IntegrityError:
+                # the reference is already taken; pick another one
+                continue
+        self._wake_up.set()
+        return reference
+
+    def lookup(self, reference):
+        """Finds a grievance by its local reference, or by the id or key of its Jira issue. Returns None if unknown."""
+        rows = self._execute(
+            "SELECT * FROM grievances WHERE reference = ? OR jira_id = ? OR UPPER(jira_key) = ?",
+            (str(reference).strip().upper(), str(reference).strip(), str(reference).strip().upper()),
+        )
+        return dict(rows[0]) if rows else None
+
+    def stats(self):
+        rows = self._execute("SELECT status, COUNT(*) AS count FROM grievances GROUP BY status")
+        return {row["status"]: row["count"] for row in rows}
+
+    def start(self):
+        """Starts the background submitter. Safe to call more than once."""
+        if self._submitter is None or not self._submitter.is_alive():
+            self._stopped.clear()
+            self._submitter = threading.Thread(target=self._run, name="grievance-submitter", daemon=True)
+            self._submitter.start()
+
+    def stop(self, timeout=None):
+        self._stopped.set()
+        self._wake_up.set()
+        if self._submitter is not None:
+            self._submitter.join(timeout)
+
+    def _run(self):
+        while not self._stopped.is_set():
+            try:
+                while self.submit_pending() == self.batch_size:
+                    # a full batch; there may be more waiting
+                    pass
+            except Exception as e:
+                logger.error(f"Error submitting the grievances to Jira: {e}")
+            self._wake_up.wait(self.submit_interval)
+            self._wake_up.clear()
+
+    def submit_pending(self):
+        """Submits a batch of the pending grievances that are due. Returns the number of grievances in the batch."""
+        batch = [
+            dict(row)
+            for row in self._execute(
+                "SELECT * FROM grievances WHERE status IN (?, ?) AND next_attempt_at <= ? ORDER BY created_at LIMIT ?",
+                (PENDING, FAILED, time.time(), self.batch_size),
+            )
+        ]
+        if not batch:
+            return 0
+        # grievances that were attempted before may have been created in Jira, if the attempt timed out or was
+        # interrupted. The attempt is recorded before Jira is called, so an interrupted one is looked up as well
+        retried = [grievance for grievance in batch if grievance["attempts"]]
+        self._mark_attempted(batch)
+        try:
+            if self._jira is None:
+                self._jira = self.jira_factory()
+            with backend_limits["jira"]:
+                if retried:
+                    for grievance, issue in self._find_created(retried):
+                        self._mark_submitted(grievance, issue)
+                        batch.remove(grievance)
+                if batch:
+                    self._create(batch)
+        except Exception as e:
+            logger.error(f"Error submitting a batch of {len(batch)} grievances to Jira: {e}")
+            # the client is created again for the next attempt
+            self._jira = None
+            for grievance in batch:
+                self._mark_retry(grievance, str(e))
+        return len(batch)
+
+    def _find_created(self, grievances):
+        labels = {idempotency_label(grievance["idempotency_key"]): grievance for grievance in grievances}
+        jql = "labels in (" + ", ".join(f'"{label}"' for label in labels) + ")"
+        response = self._jira.jql(jql, fields="labels", limit=len(labels))
+        for issue in response.get("issues", []):
+            for label in issue.get("fields", {}).get("labels", []):
+                if label in labels:
+                    yield labels.pop(label), issue
+
+    def _create(self, batch):
+        issues = [
+            {
+                "fields": {
+                    "project": {"key": DefaultConfig.grievance_project_key},
+                    "summary": grievance["category"],
+                    "description": grievance["description"],
+                    "issuetype": {"name": "Task"},
+                    "labels": [idempotency_label(grievance["idempotency_key"])],
+                }
+            }
+            for grievance in batch
+        ]
+        response = self._jira.create_issues(issues)
+        # the created issues are returned in the order of the request, leaving out the ones that failed
+        errors = {error.get("failedElementNumber"): error for error in response.get("errors", [])}
+        created = iter(response.get("issues", []))
+        for index, grievance in enumerate(batch):
+            if index in errors:
+                self._mark_retry(grievance, str(errors[index].get("elementErrors")))
+            else:
+                self._mark_submitted(grievance, next(created))
+        logger.info(f"submitted {len(batch) - len(errors)} grievances to Jira, {len(errors)} failed")
+
+    def _mark_attempted(self, batch):
+        now = time.time()
+        for grievance in batch:
+            grievance["attempts"] += 1
+        with self._lock:
+            self._connection.executemany(
+                "UPDATE grievances SET attempts = ?, updated_at = ? WHERE reference = ?",
+                [(grievance["attempts"], now, grievance["reference"]) for grievance in batch],
+            )
+
+    def _mark_submitted(self, grievance, issue):
+        self._execute(
+            "UPDATE grievances SET status = ?, jira_id = ?, jira_key = ?, last_error = NULL, updated_at = ?"
+            " WHERE reference = ?",
+            (SUBMITTED, str(issue["id"]), issue.get("key"), time.time(), grievance["reference"]),
+        )
+
+    def _mark_retry(self, grievance, error):
+        # the attempt was counted by _mark_attempted
+        attempts = grievance["attempts"]
+        status = FAILED if attempts >= self.max_attempts else PENDING
+        backoff = min(MAX_BACKOFF_SECONDS, self.submit_interval * 2**attempts)
+        self._execute(
+            "UPDATE grievances SET status = ?, last_error = ?, next_attempt_at = ?, updated_at = ? WHERE reference = ?",
+            (status, error, time.time() + backoff, time.time(), grievance["reference"]),
+        )
+        if attempts == self.max_attempts:
+            logger.error(
+                f"Grievance {grievance['reference']} is still not submitted to Jira after {attempts} attempts, retrying"
+                f" every {MAX_BACKOFF_SECONDS} seconds: {error}"
+            )
+
+
+def default_jira_client():
+    from atlassian import Jira
+
+    return Jira(
+        url=DefaultConfig.attlassian_url,
+        username=DefaultConfig.attlassian_user_name,
+        password=DefaultConfig.attlassian_api_key,
+    )
+
+
+_queue = None
+_queue_lock = threading.Lock()
+
+
+def get_grievance_queue():
+    """Returns the grievance queue of the process, opening it and starting its submitter on first use."""
+    global _queue
+    with _queue_lock:
+        if _queue is None:
+            _queue = GrievanceQueue(
+                DefaultConfig.grievance_queue_db,
+                batch_size=DefaultConfig.grievance_batch_size,
+                submit_interval=DefaultConfig.grievance_submit_interval_seconds,
+                max_attempts=DefaultConfig.grievance_max_attempts,
+            )
+            _queue.start()
+        return _queue
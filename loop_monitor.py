@@ -0,0 +1,218 @@
+"""
+Event loop lag monitor and blocking-call detector.
+
+All the chat sessions of a worker share one asyncio event loop, so a sync tool call or a slow handler in one
+session delays the audio of every other session. The monitor:
+- samples the lag of the event loop
+- watches the loop from a separate thread, and records the stack of any callback that blocks it for longer
+  than a threshold
+- runs a sampling profiler on the loop thread for a time window, on demand
+- times the tools (on the thread they run on, leaving out the wait for a thread) and the dispatch handlers
+  (the coroutine ones until they complete)
+
+Stacks are attributed to the RTWSClient methods and dispatch handlers they pass through, using the labels
+registered with `monitor.label()`. The tools run on their own threads, so they do not show up in these stacks.
+"""
+import asyncio
+import collections
+import datetime
+import os
+import sys
+import threading
+import time
+import traceback
+from chainlit.logger import logger
+
+
+class _Timed:
+    """Context manager that adds the time spent in a block to the timings of a label."""
+
+    __slots__ = ("monitor", "label", "start")
+
+    def __init__(self, monitor, label):
+        self.monitor = monitor
+        self.label = label
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        elapsed_ms = (time.perf_counter() - self.start) * 1000
+        # the tools are timed on the threads they run on
+        with self.monitor.timings_lock:
+            timing = self.monitor.timings[self.label]
+            timing[0] += 1
+            timing[1] += elapsed_ms
+            timing[2] = max(timing[2], elapsed_ms)
+        return False
+
+
+class LoopMonitor:
+    def __init__(self):
+        self.enabled = False
+        self.lag_interval_ms = 50
+        self.slow_callback_ms = 100
+        self.profile_dir = "profiles"
+        self.lag_samples = collections.deque(maxlen=2000)
+        self.max_lag_ms = 0.0
+        self.stalls = collections.deque(maxlen=50)
+        self.stall_count = 0
+        # label -> [count, total ms, max ms]
+        self.timings = collections.defaultdict(lambda: [0, 0.0, 0.0])
+        self.timings_lock = threading.Lock()
+        self.profiling_until = None
+        self._labels = {}
+        self._loop = None
+        self._loop_thread_id = None
+        self._heartbeat = 0.0
+        self._lag_task = None
+
+    def label(self, func, label):
+        """Attributes the time spent in `func` (and whatever it calls, unless labelled itself) to `label`."""
+        code = getattr(func, "__code__", None)
+        if code is not None:
+            self._labels[code] = label
+
+    def timed(self, label):
+        return _Timed(self, label)
+
+    def start(self, slow_callback_ms=None, lag_interval_ms=None, profile_dir=None):
+        """Starts monitoring the running event loop. Safe to call more than once."""
+        if self.enabled:
+            return
+        if slow_callback_ms is not None:
+            self.slow_callback_ms = slow_callback_ms
+        if lag_interval_ms is not None:
+            self.lag_interval_ms = lag_interval_ms
+        if profile_dir is not None:
+            self.profile_dir = profile_dir
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread_id = threading.get_ident()
+        self._heartbeat = time.monotonic()
+        self.enabled = True
+        self._lag_task = asyncio.create_task(self._sample_lag())
+        threading.Thread(target=self._watch, name="loop-monitor-watchdog", daemon=True).start()
+        logger.info(f"event loop monitor started, reporting callbacks slower than {self.slow_callback_ms} ms")
+
+    def stop(self):
+        self.enabled = False
+        self.profiling_until = None
+        if self._lag_task:
+            self._lag_task.cancel()
+            self._lag_task = None
+
+    async def _sample_lag(self):
+        interval = self.lag_interval_ms / 1000
+        while self.enabled:
+            start = time.monotonic()
+            await asyncio.sleep(interval)
+            self._heartbeat = time.monotonic()
+            lag_ms = max(0.0, (self._heartbeat - start - interval) * 1000)
+            self.lag_samples.append(lag_ms)
+            self.max_lag_ms = max(self.max_lag_ms, lag_ms)
+
+    def _loop_frame(self):
+        return sys._current_frames().get(self._loop_thread_id)
+
+    def _attribute(self, frame):
+        """Returns the label of the innermost labelled function on the stack of the frame."""
+        while frame is not None:
+            label = self._labels.get(frame.f_code)
+            if label:
+                return label
+            frame = frame.f_back
+        return "unattributed"
+
+    def _watch(self):
+        """Runs on a separate thread; captures the stack of the loop thread while it is blocked."""
+        stall_reported_for = None
+        while self.enabled:
+            time.sleep(self.slow_callback_ms / 2000)
+            heartbeat = self._heartbeat
+            blocked_ms = (time.monotonic() - heartbeat) * 1000 - self.lag_interval_ms
+            if blocked_ms < self.slow_callback_ms or stall_reported_for == heartbeat:
+                continue
+            # report each stall once, however long it lasts
+            stall_reported_for = heartbeat
+            frame = self._loop_frame()
+            if frame is None:
+                continue
+            stall = {
+                "at": datetime.datetime.utcnow().isoformat(),
+                "blocked_ms": round(blocked_ms, 1),
+                "label": self._attribute(frame),
+                "stack": "".join(traceback.format_stack(frame)),
+            }
+            self.stalls.append(stall)
+            self.stall_count += 1
+            logger.warning(
+                f"event loop blocked for more than {stall['blocked_ms']} ms in {stall['label']}:\n{stall['stack']}"
+            )
+
+    def start_profile(self, seconds, interval_ms=5):
+        """
+        Samples the stack of the loop thread every `interval_ms` for `seconds`, on a separate thread.
+        The stacks are written in the folded format used by flame graph tools, to the profile directory.
+        Returns False if a profile is already being taken.
+        """
+        if not self.enabled or self.profiling_until is not None:
+            return False
+        self.profiling_until = time.monotonic() + seconds
+        threading.Thread(target=self._profile, args=(interval_ms,), name="loop-monitor-profiler", daemon=True).start()
+        logger.info(f"profiling the event loop for {seconds} seconds")
+        return True
+
+    def _profile(self, interval_ms):
+        stacks = collections.Counter()
+        labels = collections.Counter()
+        try:
+            while self.profiling_until is not None and time.monotonic() < self.profiling_until:
+                frame = self._loop_frame()
+                if frame is not None:
+                    labels[self._attribute(frame)] += 1
+                    stack = []
+                    while frame is not None:
+                        code = frame.f_code
+                        stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                        frame = frame.f_back
+                    stacks[";".join(reversed(stack))] += 1
+                time.sleep(interval_ms / 1000)
+        finally:
+            self.profiling_until = None
+        os.makedirs(self.profile_dir, exist_ok=True)
+        file_name = os.path.join(
+            self.profile_dir, f"loop-profile-{datetime.datetime.utcnow().strftime('%Y%m%dT%H%M%S')}.folded"
+        )
+        with open(file_name, "w") as profile:
+            for stack, count in stacks.items():
+                profile.write(f"{stack} {count}\n")
+        samples = sum(labels.values()) or 1
+        summary = ", ".join(f"{label} {count * 100 / samples:.1f}%" for label, count in labels.most_common(10))
+        logger.info(f"event loop profile written to {file_name}. Time by label: {summary}")
+
+    def snapshot(self):
+        """Returns the current lag statistics, timings and recent stalls, for the admin endpoint."""
+        samples = sorted(self.lag_samples)
+
+        def percentile(pct):
+            if not samples:
+                return None
+            return round(samples[min(len(samples) - 1, int(len(samples) * pct / 100))], 1)
+
+        return {
+            "enabled": self.enabled,
+            "profiling": self.profiling_until is not None,
+            "loop_lag_ms": {"p50": percentile(50), "p99": percentile(99), "max": round(self.max_lag_ms, 1)},
+            "stall_count": self.stall_count,
+            "recent_stalls": list(self.stalls),
+            "timings": {
+                label: {"count": count, "total_ms": round(total, 1), "max_ms": round(longest, 1)}
+                for label, (count, total, longest) in sorted(
+                    self.timings.items(), key=lambda item: item[1][1], reverse=True
+                )
+            },
+        }
+
+
+monitor = LoopMonitor()
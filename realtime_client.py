@@ -8,27 +8,37 @@ import websockets
 import json
 import datetime
 import asyncio
-from collections import defaultdict
-from envconfig import DefaultConfig
+import contextvars
+import functools
+import time
+import types
+import weakref
+from loop_monitor import monitor
+from capacity import tool_executor
+from session_recorder import SessionRecorder
+from conversation_window import ConversationWindow
 from tools import available_functions, tools_list
 
 
-base_url = f"wss://{DefaultConfig.az_open_ai_endpoint_name}.openai.azure.com/"
-api_key = DefaultConfig.az_openai_key
-api_version = DefaultConfig.az_openai_api_version
-model_name = DefaultConfig.model_name
-url = f"{base_url}openai/realtime?api-version={api_version}&deployment={model_name}&api-key={api_key}"
-
+def get_realtime_url():
+    """Builds the URL of the Realtime API endpoint from the configuration, at the time of connecting."""
+    base_url = f"wss://{DefaultConfig.az_open_ai_endpoint_name}.openai.azure.com/"
+    api_key = DefaultConfig.az_openai_key
+    api_version = DefaultConfig.az_openai_api_version
+    model_name = DefaultConfig.model_name
+    return f"{base_url}openai/realtime?api-version={api_version}&deployment={model_name}&api-key={api_key}"
 
-class RTWSClient:
 
-    def __init__(self, system_prompt: str):
-        self.ws = None
-        self.system_prompt = system_prompt
-        self.event_handlers = defaultdict(list)
-        self.session_config = {
+@functools.lru_cache(maxsize=8)
+def get_session_template(system_prompt):
+    """
+    Returns the session configuration for a system prompt. It is built once and shared, read only,
+    by all the clients using the same prompt, rather than copied into every session.
+    """
+    return types.MappingProxyType(
+        {
             "modalities": ["text", "audio"],
-            "instructions": self.system_prompt,
+            "instructions": system_prompt,
             "voice": "shimmer",
             "input_audio_format": "pcm16",
             "output_audio_format": "pcm16",
@@ -45,20 +55,108 @@ class RTWSClient:
             "temperature": 0.8,
             "max_response_output_tokens": 4096,
         }
-        self.response_config = {"modalities": ["text", "audio"]}
+    )
+
+
+RESPONSE_CONFIG = types.MappingProxyType({"modalities": ["text", "audio"]})
+
+# the clients with an open connection, checked by the idle reaper
+_connected_clients = weakref.WeakSet()
+_idle_reaper = None
+
+
+async def reap_idle_sessions(idle_timeout):
+    """
+    Disconnects the clients that have not sent or received an event for `idle_timeout` seconds,
+    raising a session.idle event to their handlers so that the UI can tell the user.
+    """
+    interval = max(1.0, min(30.0, idle_timeout / 4))
+    while True:
+        await asyncio.sleep(interval)
+        now = time.monotonic()
+        for client in list(_connected_clients):
+            if now - client.last_activity < idle_timeout:
+                continue
+            logger.info(f"disconnecting a realtime session idle for more than {idle_timeout} seconds")
+            try:
+                await client.disconnect()
+            except Exception as e:
+                logger.error(f"Error disconnecting an idle session: {e}")
+            # the handlers run even if the disconnect failed, so that the session slot is freed. A failing
+            # handler must not stop the reaper, which serves all the sessions of the worker
+            try:
+                # run the handlers in the context of the session (the chainlit session, for the UI handlers)
+                client.context.run(
+                    client.dispatch, "session.idle", {"type": "session_idle", "idle_timeout": idle_timeout}
+                )
+            except Exception as e:
+                logger.error(f"Error notifying an idle session: {e}")
+
+
+def ensure_idle_reaper():
+    global _idle_reaper
+    if DefaultConfig.session_idle_timeout_seconds > 0 and (_idle_reaper is None or _idle_reaper.done()):
+        _idle_reaper = asyncio.create_task(reap_idle_sessions(DefaultConfig.session_idle_timeout_seconds))
+
+
+class RTWSClient:
+
+    # a worker holds one client per chat, so these are kept to a fixed set of attributes
+    __slots__ = (
+        "ws",
+        "url",
+        "functions",
+        "recorder",
+        "conversation",
+        "system_prompt",
+        "event_handlers",
+        "session_config",
+        "response_config",
+        "last_activity",
+        "context",
+        "__weakref__",
+    )
+
+    def __init__(self, system_prompt: str, url: str = None):
+        self.ws = None
+        # the Realtime API endpoint to connect to. Defaults to the one in the configuration;
+        # the benchmarks point this to a local stand-in of the endpoint
+        self.url = url
+        # the functions the model can call. The session replay swaps these for the recorded outputs
+        self.functions = available_functions
+        # records the events of the session when session_recording_dir is configured
+        self.recorder = None
+        # tracks the server-side conversation of the connection, to prune its oldest turns when it grows over the configured budget
+        self.conversation = None
+        self.system_prompt = system_prompt
+        # handler lists are created only for the events that have handlers
+        self.event_handlers = {}
+        self.session_config = get_session_template(system_prompt)
+        self.response_config = RESPONSE_CONFIG
+        # time of the last event sent or received, used to disconnect idle sessions
+        self.last_activity = time.monotonic()
+        # the context the client was connected in, to run the handlers of the events raised by the idle reaper
+        self.context = None
 
     def on(self, event_name, handler):
-        self.event_handlers[event_name].append(handler)
+        self.event_handlers.setdefault(event_name, []).append(handler)
+        monitor.label(handler, f"handler:{event_name}:{handler.__name__}")
 
     def dispatch(self, event_name, event):
         """Dispatches an event to all registered handlers for the given event name.
         In this case, this dispatcher is used to notify the Chainlit UI of events it should know of
         to take actions in the UI"""
-        for handler in self.event_handlers[event_name]:
+        for handler in self.event_handlers.get(event_name, ()):
             if inspect.iscoroutinefunction(handler):
-                asyncio.create_task(handler(event))
+                asyncio.create_task(self._timed_handler(event_name, handler, event))
             else:
-                handler(event)
+                with monitor.timed(f"handler:{event_name}"):
+                    handler(event)
+
+    async def _timed_handler(self, event_name, handler, event):
+        """Runs a coroutine handler, timing it from its start to its completion, awaits included."""
+        with monitor.timed(f"handler:{event_name}"):
+            await handler(event)
 
     def is_connected(self):
         return self.ws is not None
@@ -72,23 +170,42 @@ class RTWSClient:
             # raise Exception("Already connected")
             self.log("Already connected")
         self.ws = await websockets.connect(
-            url,
+            self.url or get_realtime_url(),
             additional_headers={
-                "Authorization": f"Bearer {api_key}",
+                "Authorization": f"Bearer {DefaultConfig.az_openai_key}",
                 "OpenAI-Beta": "realtime=v1",
             },
         )
         print(f"Connected to realtime API....")
+        self.last_activity = time.monotonic()
+        self.context = contextvars.copy_context()
+        _connected_clients.add(self)
+        ensure_idle_reaper()
+        if DefaultConfig.session_recording_dir:
+            self.recorder = SessionRecorder(DefaultConfig.session_recording_dir)
+        # every connection starts a new conversation on the server
+        if DefaultConfig.conversation_pruning != "off":
+            self.conversation = ConversationWindow(
+                mode=DefaultConfig.conversation_pruning,
+                max_items=DefaultConfig.conversation_max_items,
+                max_tokens=DefaultConfig.conversation_max_tokens,
+                keep_last_turns=DefaultConfig.conversation_keep_last_turns,
+            )
         asyncio.create_task(self.receive())
 
         await self.update_session()
 
     async def disconnect(self):
-        """Disconnects the client from the WS Connection to the Realtime API."""
+        """Disconnects the client from the WS Connection to the Realtime API, and frees the state of the connection."""
+        _connected_clients.discard(self)
         if self.ws:
             await self.ws.close()
             self.ws = None
             self.log(f"Disconnected from the Realtime API")
+        if self.recorder:
+            await self.recorder.close()
+            self.recorder = None
+        self.conversation = None
 
     def _generate_id(self, prefix):
         return f"{prefix}{int(datetime.datetime.utcnow().timestamp() * 1000)}"
@@ -103,6 +220,9 @@ class RTWSClient:
         if not isinstance(data, dict):
             raise Exception("data must be a dictionary")
         event = {"event_id": self._generate_id("evt_"), "type": event_name, **data}
+        self.last_activity = time.monotonic()
+        if self.recorder:
+            self.recorder.record("out", event)
         await self.ws.send(json.dumps(event))
 
     async def send_user_message_content(self, content=[]):
@@ -122,7 +242,7 @@ class RTWSClient:
                 },
             )
             # this is the trigger to the server to start responding to the user query
-            await self.send("response.create", {"response": self.response_config})
+            await self.send("response.create", {"response": dict(self.response_config)})
             
             # raise this event to the UI to pause the audio playback, in case it is doing so already, 
             # when the user submits a query in the chat interface
@@ -135,7 +255,7 @@ class RTWSClient:
         Asynchronously updates the session configuration if the client is connected. These include aspects like voice activate detection, function calls, etc.
         """
         if self.is_connected():
-            await self.send("session.update", {"session": self.session_config})
+            await self.send("session.update", {"session": dict(self.session_config)})
             print("session updated...")
 
     async def receive(self):
@@ -147,6 +267,11 @@ class RTWSClient:
         """
         async for message in self.ws:
             event = json.loads(message)
+            self.last_activity = time.monotonic()
+            if self.recorder:
+                self.recorder.record("in", event)
+            if self.conversation:
+                self.conversation.track(event)
             # print("event_type", event_type)
             if event["type"] == "error":
                 # print("Some error !!", message)
@@ -167,7 +292,7 @@ class RTWSClient:
             elif event["type"] == "input_audio_buffer.committed":
                 # user has stopped speaking. The audio delta input from the user captured till now should now be processed by the server.
                 # Hence we need to send a 'response.create' event to signal the server to respond
-                await self.send("response.create", {"response": self.response_config})
+                await self.send("response.create", {"response": dict(self.response_config)})
             elif event["type"] == "input_audio_buffer.speech_started":
                 # The server has detected speech input from the user. Hence use this event to signal the UI to stop playing any audio if playing one
                 # print("conversation interrupted.......")
@@ -225,9 +350,16 @@ class RTWSClient:
                                 .get("call_id", None)
                             )
 
-                            function_to_call = available_functions[function_name]
-                            # invoke the function with the arguments and get the response
-                            response = function_to_call(**arguments)
+                            function_to_call = self.functions[function_name]
+                            # invoke the function with the arguments and get the response. It runs on the tool thread pool,
+                            # so that the calls to its backend do not hold up the event loop shared by all the sessions
+                            def call_tool():
+                                # timed on the tool thread, so that the wait for a free thread is not counted.
+                                # That wait is reported with the tool pool in the capacity stats
+                                with monitor.timed(f"tool:{function_name}"):
+                                    return function_to_call(**arguments)
+
+                            response = await tool_executor.run(call_tool)
                             print(
                                 f"called function {function_name}, and the response is:",
                                 response,
@@ -245,8 +377,9 @@ class RTWSClient:
                             )
                             # signal the model(server) to generate a response based on the function call output sent to it
                             await self.send(
-                                "response.create", {"response": self.response_config}
+                                "response.create", {"response": dict(self.response_config)}
                             )
+                    await self.prune_conversation()
                 except Exception as e:
                     print("Error in processing function call:", e)
                     print(traceback.format_exc())
@@ -255,6 +388,28 @@ class RTWSClient:
                 # print("Unknown event type:", event.get("type"))
                 pass
 
+    async def prune_conversation(self):
+        """
+        Removes the oldest turns from the server-side conversation once it is over the budget of the configured policy,
+        replacing them with a summary if the policy asks for one. The last turns, including the current one, are always kept.
+        """
+        # the session can be disconnected (e.g. by the idle reaper) while the deletes are sent, which drops the window
+        conversation = self.conversation
+        if conversation is None:
+            return
+        deleted, summary_item = conversation.prune()
+        if summary_item and self.is_connected():
+            await self.send("conversation.item.create", {"previous_item_id": "root", "item": summary_item})
+        for item_id in deleted:
+            if not self.is_connected():
+                return
+            await self.send("conversation.item.delete", {"item_id": item_id})
+        if deleted:
+            logger.info(
+                f"pruned {len(deleted)} conversation items, ~{conversation.total_tokens} tokens left. "
+                f"Input tokens of the last responses: {list(conversation.input_tokens)[-5:]}"
+            )
+
     async def close(self):
         await self.ws.close()
 
@@ -276,7 +431,6 @@ class RTWSClient:
                 },
             )
 
-
     # this is what the response looks like when a function call is detected
     # {
     #     "type": "response.done",
@@ -312,4 +466,10 @@ class RTWSClient:
     #             },
     #         },
     #     },
-    # }
\ No newline at end of file
+    # }
+
+
+# attribute the time spent on the event loop in the client's own code to the method it was spent in
+for _name, _member in vars(RTWSClient).items():
+    if inspect.isfunction(_member):
+        monitor.label(_member, f"RTWSClient.{_name}")
@@ -0,0 +1,290 @@
+"""
+Records the events exchanged with the Realtime API in a session, to reproduce latency and ordering issues
+seen in production, and replays them through RTWSClient.
+
+A recording is made of two files:
+- <name>.jsonl: an append-only log with a header line, followed by one line per event, with the time in seconds
+  since the start of the session, the direction ("in" from the server, "out" to the server) and the event.
+- <name>.pcm: the raw PCM16 audio of the events, in the order they were recorded. The audio fields of the
+  events in the log are replaced with the offset and length of their audio in this file.
+
+Recording only appends the event to a list on the event loop. Opening the files, decoding the audio, serializing
+and writing the events, and closing the files is done on a worker thread, by a background task.
+"""
+import asyncio
+import base64
+import datetime
+import json
+import mmap
+import os
+import time
+import uuid
+from chainlit.logger import logger
+
+# the events that carry audio, and the field the base64 encoded audio is in
+AUDIO_FIELDS = {
+    "response.audio.delta": "delta",
+    "input_audio_buffer.append": "audio",
+}
+
+RECORDING_VERSION = 1
+
+
+class SessionRecorder:
+    def __init__(self, directory, flush_interval=0.5, max_pending=20000):
+        self.directory = directory
+        name = f"{datetime.datetime.utcnow().strftime('%Y%m%dT%H%M%S')}-{uuid.uuid4().hex[:8]}"
+        self.log_path = os.path.join(directory, f"{name}.jsonl")
+        self.audio_path = os.path.join(directory, f"{name}.pcm")
+        self.flush_interval = flush_interval
+        # events are dropped, rather than letting memory grow, if the writer cannot keep up
+        self.max_pending = max_pending
+        self.dropped = 0
+        self._pending = []
+        self._started = time.monotonic()
+        self._audio_offset = 0
+        self._log_file = None
+        self._audio_file = None
+        self._closed = False
+        self._closing = asyncio.Event()
+        # the files are opened, written and closed by this one task, one batch at a time, so the writes stay in
+        # order. The events recorded before the files are open are kept until the first batch
+        self._writer = asyncio.create_task(self._write_periodically())
+
+    def _open(self):
+        os.makedirs(self.directory, exist_ok=True)
+        self._log_file = open(self.log_path, "a", encoding="utf-8")
+        self._audio_file = open(self.audio_path, "ab")
+        self._log_file.write(
+            json.dumps(
+                {
+                    "type": "session.recording",
+                    "version": RECORDING_VERSION,
+                    "started_at": datetime.datetime.utcnow().isoformat(),
+                    "audio_file": os.path.basename(self.audio_path),
+                }
+            )
+            + "\n"
+        )
+
+    def _close_files(self):
+        for file in (self._log_file, self._audio_file):
+            if file is not None:
+                file.close()
+
+    def record(self, direction, event):
+        """Records an event sent ("out") or received ("in"). The event must not be modified afterwards."""
+        if self._closed:
+            return
+        if len(self._pending) >= self.max_pending:
+            self.dropped += 1
+            return
+        self._pending.append((time.monotonic() - self._started, direction, event))
+
+    async def _write_periodically(self):
+        try:
+            await asyncio.to_thread(self._open)
+        except Exception as e:
+            # the session goes on without a recording
+            logger.error(f"Error opening the session recording {self.log_path}: {e}")
+            self._closed = True
+            self._pending = []
+            await asyncio.to_thread(self._close_files)
+            return
+        while not self._closing.is_set():
+            try:
+                await asyncio.wait_for(self._closing.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            await self._flush()
+        # the events recorded while the last batch was being written
+        await self._flush()
+
+    async def _flush(self):
+        if self._pending:
+            batch, self._pending = self._pending, []
+            await asyncio.to_thread(self._write_batch, batch)
+
+    def _write_batch(self, batch):
+        lines = []
+        for t, direction, event in batch:
+            audio_field = AUDIO_FIELDS.get(event.get("type"))
+            if audio_field and audio_field in event:
+                audio = base64.b64decode(event[audio_field])
+                self._audio_file.write(audio)
+                event = {key: value for key, value in event.items() if key != audio_field}
+                event["audio_offset"] = self._audio_offset
+                event["audio_length"] = len(audio)
+                self._audio_offset += len(audio)
+            lines.append(json.dumps({"t": round(t, 6), "dir": direction, "event": event}))
+        self._log_file.write("\n".join(lines) + "\n")
+        self._audio_file.flush()
+        self._log_file.flush()
+
+    async def close(self):
+        """Writes out the pending events and closes the recording."""
+        if self._closed:
+            return
+        self._closed = True
+        # let the writer finish the batch it may be writing, and write out the rest, before closing the files
+        self._closing.set()
+        await self._writer
+        if self._log_file is None or self._log_file.closed:
+            # the recording could not be opened
+            return
+        await asyncio.to_thread(self._close_files)
+        if self.dropped:
+            logger.warning(f"session recorder dropped {self.dropped} events in {self.log_path}")
+        logger.info(f"session recorded to {self.log_path}")
+
+
+class SessionRecording:
+    """Reads a recording. The audio file is memory mapped, and read only for the events that are replayed."""
+
+    def __init__(self, log_path):
+        self.log_path = log_path
+        with open(log_path, encoding="utf-8") as log_file:
+            self.header = json.loads(log_file.readline())
+            self.entries = [json.loads(line) for line in log_file if line.strip()]
+        audio_path = os.path.join(os.path.dirname(log_path), self.header["audio_file"])
+        self._audio_file = open(audio_path, "rb")
+        # an empty file cannot be memory mapped
+        self._audio = (
+            mmap.mmap(self._audio_file.fileno(), 0, access=mmap.ACCESS_READ)
+            if os.fstat(self._audio_file.fileno()).st_size
+            else b""
+        )
+
+    def close(self):
+        if isinstance(self._audio, mmap.mmap):
+            self._audio.close()
+        self._audio_file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def audio(self, event):
+        """Returns the PCM16 audio of an event as a memoryview over the audio file, or None if it has none."""
+        if "audio_offset" not in event:
+            return None
+        return memoryview(self._audio)[event["audio_offset"] : event["audio_offset"] + event["audio_length"]]
+
+    def event(self, entry):
+        """Returns the event of a log entry as it was sent or received, with its audio encoded back in base64."""
+        event = entry["event"]
+        audio_field = AUDIO_FIELDS.get(event.get("type"))
+        if audio_field and "audio_offset" in event:
+            event = {key: value for key, value in event.items() if key not in ("audio_offset", "audio_length")}
+            event[audio_field] = base64.b64encode(self.audio(entry["event"])).decode("utf-8")
+        return event
+
+    def inbound(self):
+        return [entry for entry in self.entries if entry["dir"] == "in"]
+
+    def outbound(self):
+        return [entry for entry in self.entries if entry["dir"] == "out"]
+
+    def function_outputs(self):
+        """Returns the outputs of the function calls the client sent in the session, by call id."""
+        outputs = {}
+        for entry in self.outbound():
+            item = entry["event"].get("item", {})
+            if item.get("type") == "function_call_output":
+                outputs[item["call_id"]] = item["output"]
+        return outputs
+
+
+class _ReplayConnection:
+    """Stands in for the websocket of RTWSClient: yields the recorded server events, and collects what is sent."""
+
+    def __init__(self, recording, speed):
+        self.recording = recording
+        self.speed = speed
+        self.sent = []
+
+    async def __aiter__(self):
+        start = time.monotonic()
+        for entry in self.recording.inbound():
+            if self.speed:
+                delay = start + entry["t"] / self.speed - time.monotonic()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            yield json.dumps(self.recording.event(entry))
+
+    async def send(self, message):
+        self.sent.append(json.loads(message))
+
+    async def close(self):
+        pass
+
+
+async def replay(client, recording, speed=1.0):
+    """
+    Replays the server events of a recording through an RTWSClient, and its registered handlers.
+    The events are replayed at the original timing when speed is 1, `speed` times faster otherwise,
+    or without any delay when speed is 0. The tools are not called; the outputs recorded for
+    the function calls are returned instead.
+    Returns the events the client sent during the replay. The client should not be used for a live session afterwards.
+    """
+    outputs = recording.function_outputs()
+    # the client calls the function of the first output of a completed response
+    response_calls = []
+    for entry in recording.inbound():
+        response = entry["event"].get("response", {})
+        output = (response.get("output") or [{}])[0]
+        if response.get("status") == "completed" and output.get("type") == "function_call":
+            response_calls.append(output.get("call_id"))
+    calls = iter(response_calls)
+
+    def recorded_output(**kwargs):
+        output = outputs.get(next(calls, None))
+        return json.loads(output) if output is not None else None
+
+    connection = _ReplayConnection(recording, speed)
+    client.functions = {name: recorded_output for name in client.functions}
+    client.ws = connection
+    try:
+        await client.receive()
+    finally:
+        client.ws = None
+    return connection.sent
+
+
+def main():
+    import argparse
+    from realtime_client import RTWSClient
+
+    parser = argparse.ArgumentParser(description="Replays a recorded session, printing the events raised to the UI.")
+    parser.add_argument("log_path", help="the .jsonl file of the recording")
+    parser.add_argument("--speed", type=float, default=1.0, help="replay speed; 0 replays without any delay")
+    args = parser.parse_args()
+
+    async def run():
+        client = RTWSClient(system_prompt="")
+        start = time.monotonic()
+        for event_name in (
+            "conversation.updated",
+            "conversation.interrupted",
+            "conversation.text.delta",
+            "conversation.input.text.done",
+        ):
+
+            def show(event, event_name=event_name):
+                shown = {key: value for key, value in event.items() if key != "audio"}
+                if "audio" in event:
+                    shown["audio_bytes"] = len(event["audio"])
+                print(f"{time.monotonic() - start:9.3f} {event_name} {shown}")
+
+            client.on(event_name, show)
+        with SessionRecording(args.log_path) as recording:
+            sent = await replay(client, recording, args.speed)
+        print(f"the client sent {len(sent)} events during the replay")
+
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+import importlib
+import time
+from chainlit.logger import logger
+
+
+class Tool:
+    """A function exposed to the Realtime API, along with the schema the model sees for it."""
+
+    def __init__(self, func, description, parameters, requires=()):
+        self.func = func
+        self.name = func.__name__
+        self.description = description
+        self.parameters = parameters
+        # client libraries the tool needs. These are imported lazily by the tool itself,
+        # or ahead of time by warm_up()
+        self.requires = tuple(requires)
+
+    @property
+    def schema(self):
+        return {
+            "type": "function",
+            "name": self.name,
+            "description": self.description,
+            "parameters": self.parameters,
+        }
+
+
+_registry = {}
+_warmed_up = False
+
+
+def tool(description, parameters, requires=()):
+    """
+    Decorator that registers a function as a tool, so that its schema is declared next to its implementation.
+    :param description: description of the tool, used by the model to pick the tool
+    :param parameters: JSON schema of the arguments of the tool
+    :param requires: names of the modules the tool imports on first use
+    """
+
+    def decorator(func):
+        if func.__name__ in _registry:
+            raise ValueError(f"Tool {func.__name__} is already registered")
+        _registry[func.__name__] = Tool(func, description, parameters, requires)
+        return func
+
+    return decorator
+
+
+def get_tool(name):
+    return _registry[name]
+
+
+def get_tools_schema():
+    """Returns the list of tool definitions to send in the session configuration."""
+    return [_tool.schema for _tool in _registry.values()]
+
+
+def get_available_functions():
+    """Returns a mapping of the tool names to the functions that implement them."""
+    return {name: _tool.func for name, _tool in _registry.items()}
+
+
+def warm_up():
+    """
+    Imports the client libraries used by all the registered tools, so that the first tool call
+    in a session does not pay for it. A library that fails to import is logged and skipped; the tool
+    that needs it reports the error when it is called. Safe to call more than once.
+    """
+    global _warmed_up
+    if _warmed_up:
+        return
+    start = time.perf_counter()
+    for _tool in _registry.values():
+        for module_name in _tool.requires:
+            try:
+                importlib.import_module(module_name)
+            except Exception as e:
+                logger.error(f"Could not warm up {module_name} for the tool {_tool.name}: {e}")
+    _warmed_up = True
+    logger.info(f"tool libraries warmed up in {(time.perf_counter() - start) * 1000:.1f} ms")